@@ -0,0 +1,344 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter as CallCounter
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+# Нагрузочный стенд для цепочки вебхук -> очередь -> count_messages без сети:
+# Supabase заменяется таблицей actions в памяти, Bot API – подставным BaseRequest PTB.
+# Запуск: python bench.py [--scenario counting|stats|all] [--out results.json]
+
+os.environ.setdefault("SECRET_TOKEN", "bench")
+os.environ.setdefault("DEFAULT_PARTICIPANTS", "")
+os.environ.setdefault("JOURNAL_PATH", os.path.join(tempfile.mkdtemp(prefix="bench_"), "journal.sqlite3"))
+
+import bot  # noqa: E402
+from counters import Counter  # noqa: E402
+from telegram.ext import ApplicationBuilder  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+CHAT_ID = -1001000000000
+THREAD_ID = 7
+USERS = {424546089: "Егор", 1181433072: "Ян"}
+
+
+def percentile(values, q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(values) -> dict:
+    return {
+        "p50_ms": _ms(percentile(values, 50)),
+        "p95_ms": _ms(percentile(values, 95)),
+        "p99_ms": _ms(percentile(values, 99)),
+        "max_ms": _ms(max(values) if values else None),
+    }
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value * 1000, 3)
+
+
+# Таблица actions в памяти с интерфейсом ActionsStore; calls считает обращения к БД так,
+# как их делает настоящий клиент (fetch_counts – select, upsert_counts – upsert, чтение – по запросу на страницу)
+class FakeActionsStore:
+    def __init__(self, latency: float = 0.0, page_size: int = 1000):
+        self.latency = latency
+        self.page_size = page_size
+        self.rows: Dict[tuple, int] = {}
+        self.calls = CallCounter()
+
+    async def _round_trip(self, operation: str) -> None:
+        self.calls[operation] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def connect(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def fetch_counts(self, keys) -> dict:
+        keys = set(keys)
+        if not keys:
+            return {}
+        await self._round_trip("increment_select")
+        return {key: self.rows[key] for key in keys if key in self.rows}
+
+    async def upsert_counts(self, targets: dict) -> None:
+        if not targets:
+            return
+        await self._round_trip("increment_upsert")
+        self.rows.update(targets)
+
+    async def iter_range(self, start=None, end=None, chat_id=None, thread_id=None, user_ids=None):
+        start_s = start.isoformat() if start else None
+        end_s = end.isoformat() if end else None
+        user_ids = set(user_ids) if user_ids else None
+        matched = sorted(
+            (day, c, t, u, count) for (c, t, u, day), count in self.rows.items()
+            if (start_s is None or day >= start_s) and (end_s is None or day < end_s)
+            and (chat_id is None or c == chat_id) and (thread_id is None or t == thread_id)
+            and (user_ids is None or u in user_ids)
+        )
+        for offset in range(0, len(matched) + 1, self.page_size):
+            await self._round_trip("select_page")
+            for day, c, t, u, count in matched[offset:offset + self.page_size]:
+                yield {"chat_id": c, "thread_id": t, "user_id": u, "date": day, "count": count}
+
+    async def totals(self, start=None, end=None, chat_id=None, thread_id=None) -> dict:
+        result = {}
+        async for row in self.iter_range(start, end, chat_id, thread_id):
+            key = (row["chat_id"], row["thread_id"], row["user_id"])
+            result[key] = result.get(key, 0) + row["count"]
+        return result
+
+
+# Подставной Bot API: отвечает как Telegram и считает вызовы по методам
+class FakeTelegramRequest(BaseRequest):
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = CallCounter()
+        self._message_id = 10_000
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _message(self, params: dict, **extra) -> dict:
+        self._message_id += 1
+        message = {
+            "message_id": params.get("message_id", self._message_id),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", CHAT_ID)), "type": "supergroup"},
+        }
+        message.update(extra)
+        return message
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = self._message(params, text=params.get("text", ""))
+        elif api_method == "sendPhoto":
+            photo = [{"file_id": f"photo-{self._message_id}", "file_unique_id": f"u{self._message_id}", "width": 1, "height": 1}]
+            result = self._message(params, photo=photo)
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+def text_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": CHAT_ID, "type": "supergroup", "title": "bench", "is_forum": True},
+            "from": {"id": user_id, "is_bot": False, "first_name": USERS[user_id]},
+            "message_thread_id": THREAD_ID,
+            "is_topic_message": True,
+            "text": "сообщение",
+        },
+    }
+
+
+async def setup(db_latency: float, tg_latency: float):
+    store = FakeActionsStore(latency=db_latency)
+    telegram = FakeTelegramRequest(latency=tg_latency)
+    bot.store = store
+    await bot.journal.open()
+    bot.outbound.start()
+    bot.SECRET_TOKEN = os.environ["SECRET_TOKEN"]
+    application = ApplicationBuilder().token("1:bench").request(telegram).get_updates_request(telegram).updater(None).build()
+    bot.register_handlers(application)
+    await application.initialize()
+    bot.application = application
+    counter = bot.registry.register(Counter(CHAT_ID, THREAD_ID, dict(USERS), msg_id=1))
+    return store, telegram, counter
+
+
+# Смещения отправки: steady – равномерно, burst – пачками burst_size с той же средней скоростью
+def schedule(count: int, rate: float, shape: str, burst_size: int):
+    if shape == "burst":
+        return [(i // burst_size) * burst_size / rate for i in range(count)]
+    return [i / rate for i in range(count)]
+
+
+async def run_counting(args, store, telegram) -> dict:
+    client = bot.app.test_client()
+    headers = {"X-Telegram-Bot-Api-Secret-Token": bot.SECRET_TOKEN}
+    sent, acked, done, statuses = {}, {}, {}, CallCounter()
+    process = bot.update_queue._process
+
+    async def tracked(raw: dict) -> None:
+        await process(raw)
+        done[raw["update_id"]] = time.perf_counter()
+
+    bot.update_queue._process = tracked
+    bot.update_queue.start()
+    bot.journal.start(store)
+    store.calls.clear()
+    telegram.calls.clear()
+    user_ids = list(USERS)
+
+    async def post(update_id: int) -> None:
+        sent[update_id] = time.perf_counter()
+        response = await client.post("/telegram", json=text_update(update_id, random.choice(user_ids)), headers=headers)
+        acked[update_id] = time.perf_counter()
+        statuses[response.status_code] += 1
+
+    started = time.perf_counter()
+    tasks = []
+    for update_id, offset in enumerate(schedule(args.updates, args.rate, args.shape, args.burst_size), start=1):
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(post(update_id)))
+    await asyncio.gather(*tasks)
+    accepted = statuses.get(200, 0)
+    deadline = time.perf_counter() + args.drain_timeout
+    while len(done) < accepted and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    # Дожидаемся переноса журнала и последней склеенной правки
+    await bot.journal.flush(store)
+    await asyncio.sleep(bot.counter_editor.window + 0.1)
+    processed = len(done)
+    return {
+        "scenario": "counting",
+        "shape": args.shape,
+        "target_rate": args.rate,
+        "updates_sent": args.updates,
+        "updates_processed": processed,
+        "http_statuses": dict(statuses),
+        "updates_per_sec": round(processed / elapsed, 2) if elapsed else None,
+        "ack_latency": latency_summary([acked[i] - sent[i] for i in acked]),
+        "end_to_end_latency": latency_summary([done[i] - sent[i] for i in done]),
+        "db_calls": dict(store.calls),
+        "db_calls_per_update": round(sum(store.calls.values()) / processed, 4) if processed else None,
+        "edits": telegram.calls.get("editMessageText", 0),
+        "edits_per_update": round(telegram.calls.get("editMessageText", 0) / processed, 4) if processed else None,
+    }
+
+
+def fill_history(store: FakeActionsStore, days: int) -> None:
+    store.rows.clear()
+    today = date.today()
+    rng = random.Random(days)
+    for offset in range(days):
+        day = (today - timedelta(days=offset)).isoformat()
+        for user_id in USERS:
+            store.rows[(CHAT_ID, THREAD_ID, user_id, day)] = rng.randint(0, 40)
+
+
+async def run_stats(args, store, counter) -> dict:
+    bot.chart_renderer.start()
+    results = []
+    for days in args.stats_sizes:
+        fill_history(store, days)
+        # Итоги счётчика должны совпадать с историей, иначе сверка индекса отнесёт разницу на сегодня
+        counter.counts = {user_id: 0 for user_id in USERS}
+        for (_, _, user_id, _), count in store.rows.items():
+            counter.counts[user_id] += count
+        bot.daily_index.drop(counter.key)
+        started = time.perf_counter()
+        await bot.counter_days(counter)
+        build_time = time.perf_counter() - started
+        load_times, render_times = [], []
+        for _ in range(args.stats_repeats):
+            started = time.perf_counter()
+            index = await bot.counter_days(counter)
+            labels, series = bot.index_chart_series(index, counter.chart_users(), *bot.parse_period("all", bot.today_ordinal()), "day")
+            loaded = time.perf_counter()
+            await bot.generate_plot(series, labels)
+            load_times.append(loaded - started)
+            render_times.append(time.perf_counter() - loaded)
+        results.append({
+            "history_days": days,
+            "rows": len(store.rows),
+            "index_build_ms": _ms(build_time),
+            "load": latency_summary(load_times),
+            "render": latency_summary(render_times),
+            "total_p50_ms": _ms(statistics.median(l + r for l, r in zip(load_times, render_times))),
+        })
+    return {"scenario": "stats", "repeats": args.stats_repeats, "sizes": results}
+
+
+async def run(args) -> dict:
+    store, telegram, counter = await setup(args.db_latency_ms / 1000, args.tg_latency_ms / 1000)
+    report = {
+        "python": sys.version.split()[0],
+        "config": {key: value for key, value in vars(args).items() if key != "out"},
+        "results": [],
+    }
+    try:
+        if args.scenario in ("counting", "all"):
+            report["results"].append(await run_counting(args, store, telegram))
+        if args.scenario in ("stats", "all"):
+            report["results"].append(await run_stats(args, store, counter))
+    finally:
+        await bot.update_queue.stop(timeout=1)
+        await bot.journal.stop(bot.store)
+        await bot.counter_editor.close()
+        await bot.outbound.stop()
+        bot.chart_renderer.shutdown()
+        await bot.application.shutdown()
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд бота-счётчика")
+    parser.add_argument("--scenario", choices=["counting", "stats", "all"], default="all")
+    parser.add_argument("--updates", type=int, default=2000, help="сколько обновлений отправить")
+    parser.add_argument("--rate", type=float, default=200.0, help="средняя скорость, обновлений/с")
+    parser.add_argument("--shape", choices=["steady", "burst"], default="steady")
+    parser.add_argument("--burst-size", type=int, default=50)
+    parser.add_argument("--db-latency-ms", type=float, default=20.0, help="задержка одного запроса к БД")
+    parser.add_argument("--tg-latency-ms", type=float, default=30.0, help="задержка одного вызова Bot API")
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--stats-sizes", type=lambda v: [int(x) for x in v.split(",")], default=[30, 365, 1825])
+    parser.add_argument("--stats-repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="файл для JSON-результатов (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    payload = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,15 @@
-from supabase import create_client, Client
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-sns.set_style('darkgrid')
-from io import BytesIO
-from datetime import datetime, timedelta
-import numpy as np
+from datetime import date, datetime
 import asyncio
+import hmac
 import logging
 import os
 import sys
+import time
 import nest_asyncio
-from functools import lru_cache  # (будет не использоваться для графика)
+from contextlib import contextmanager
 import json
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.error import BadRequest, TelegramError
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -25,17 +20,26 @@ from telegram.ext import (
 from quart import Quart, request, Response
 from hypercorn.asyncio import serve
 from hypercorn.config import Config
-from tenacity import retry, stop_after_attempt, wait_exponential
 from zoneinfo import ZoneInfo
+from journal import Journal
+from counter_editor import CounterEditor
+from outbound import CHART, EDIT, LANES, REPLY, OutboundScheduler
+from renderer import ChartRenderer, RENDER_PRESTART
+from chart_cache import ChartCache
+from daily_index import CounterDays, DailyIndex, rollup, streaks
+from snapshot import load_snapshot, save_snapshot
+from storage import ActionsStore
+from export import CONTENT_TYPES, encode_rows, parse_export_params
+from update_queue import UpdateQueue
+from workers import SharedStateSync, run_workers, try_acquire_owner
+from counters import Counter, CounterRegistry, parse_participants
+from log_pipeline import log_context, setup_logging
+from metrics import REGISTRY, HANDLER_LATENCY, EDIT_LATENCY, RENDER_LATENCY, RENDER_IN_FLIGHT, EXPORT_ROWS, timed
 
 application = None
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler()]
-)
+# Настройка логирования: запись в stdout идёт из отдельного потока через очередь
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 if sys.platform.startswith('win'):
@@ -53,53 +57,289 @@ SECRET_TOKEN = os.getenv("SECRET_TOKEN")
 # Конфигурация Supabase
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Таймаут одного запроса (сек), число одновременных запросов и размер пула соединений
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", "8"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "10"))
+
+# Журнал приращений: путь к файлу SQLite и дополнительная задержка группового коммита (сек)
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "counter_journal.sqlite3")
+JOURNAL_COMMIT_INTERVAL = float(os.getenv("JOURNAL_COMMIT_INTERVAL", "0"))
+# Перенос журнала в Supabase: максимальная задержка (сек) и порог по числу изменённых ключей
+FLUSH_MAX_DELAY = float(os.getenv("FLUSH_MAX_DELAY", "2.0"))
+FLUSH_MAX_KEYS = int(os.getenv("FLUSH_MAX_KEYS", "50"))
+# Наибольшее число записей журнала в одной пачке переноса
+FLUSH_BATCH_SIZE = int(os.getenv("FLUSH_BATCH_SIZE", "500"))
+# Минимальный интервал между правками одного сообщения-счётчика (сек)
+COUNTER_EDIT_WINDOW = float(os.getenv("COUNTER_EDIT_WINDOW", "1.0"))
+# Сколько готовых графиков держать в памяти
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", "16"))
+# Размер страницы при чтении истории для статистики
+STATS_PAGE_SIZE = int(os.getenv("STATS_PAGE_SIZE", "1000"))
+# Наибольшая длина периода статистики в днях
+STATS_MAX_DAYS = int(os.getenv("STATS_MAX_DAYS", "3660"))
+# Снимок итогов для быстрого старта и бюджет времени запуска (сек, 0 – без ограничения)
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "counter_snapshot.json")
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "0"))
+STARTUP_BUDGET_ENFORCE = os.getenv("STARTUP_BUDGET_ENFORCE", "0") == "1"
+# Исходящие вызовы Bot API: общий лимит (вызовов/с), лимит на чат (вызовов/с и запас) и число одновременных вызовов
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", str(20 / 60)))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_MAX_IN_FLIGHT = int(os.getenv("OUTBOUND_MAX_IN_FLIGHT", "8"))
+# Через сколько секунд ожидания ответ или график обгоняет правки счётчика своего чата
+OUTBOUND_YIELD_AFTER = float(os.getenv("OUTBOUND_YIELD_AFTER", "2.0"))
+# Bearer-токен выгрузки /export; без него выгрузка выключена
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN")
+# Число процессов-воркеров (1 – один процесс без общего состояния) и период синхронизации между ними (сек)
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_SYNC_INTERVAL = float(os.getenv("WORKER_SYNC_INTERVAL", "0.5"))
+# Очередь входящих обновлений: число воркеров и ёмкость
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# Участники нового счётчика по умолчанию ("user_id:Имя,..."); вызвавший /start_actions добавляется всегда.
+# По умолчанию список пуст: остальные присоединяются через /join_counter. Порядок задаёт порядок чисел на кнопке.
+DEFAULT_PARTICIPANTS = parse_participants(os.getenv("DEFAULT_PARTICIPANTS", ""))
+
+# Реестр счётчиков по (chat_id, thread_id); восстанавливается из снимка при запуске
+registry = CounterRegistry()
+# Владелец переносит журнал, правит сообщения-счётчики и сохраняет снимок; в одном процессе он всегда владелец
+is_owner = True
+
+# Доступ к actions; соединение открывается при запуске в main(), а не при импорте модуля
+store = ActionsStore(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    timeout=SUPABASE_TIMEOUT,
+    max_concurrency=SUPABASE_MAX_CONCURRENCY,
+    max_connections=SUPABASE_MAX_CONNECTIONS,
+    page_size=STATS_PAGE_SIZE,
+)
 
-FRIEND_ID = 424546089
-MY_ID = 1181433072
-
-# Хранилище данных
-bot_data = {
-    "friend_count": 0,
-    "my_count": 0,
-    "thread_id": None,
-    "actions_chat_id": None,
-    "actions_msg_id": None
-}
-data_lock = asyncio.Lock()
-
-try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    test = supabase.table("actions").select("user_id").limit(1).execute()
-    logger.info("✅ Успешное подключение к Supabase")
-except Exception as e:
-    logger.critical(f"❌ Ошибка подключения к Supabase: {str(e)}")
-    sys.exit(1)
+# Длительность фаз запуска в секундах, в порядке выполнения
+startup_timings = {}
 
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+
+def report_startup() -> None:
+    total = sum(startup_timings.values())
+    phases = ", ".join(f"{name}={seconds * 1000:.0f} мс" for name, seconds in startup_timings.items())
+    logger.info(f"Запуск занял {total * 1000:.0f} мс: {phases}")
+    if STARTUP_BUDGET and total > STARTUP_BUDGET:
+        logger.error(f"Превышен бюджет запуска: {total:.2f} с > {STARTUP_BUDGET:.2f} с")
+        if STARTUP_BUDGET_ENFORCE:
+            sys.exit(1)
+
+async def connect_supabase() -> None:
+    try:
+        await store.connect()
+        logger.info("✅ Клиент Supabase создан")
+    except Exception as e:
+        logger.critical(f"❌ Ошибка подключения к Supabase: {str(e)}")
+        sys.exit(1)
+
+# Приращения сначала фиксируются в локальном журнале, в actions их переносит фоновый проигрыватель
+journal = Journal(
+    JOURNAL_PATH,
+    commit_interval=JOURNAL_COMMIT_INTERVAL,
+    flush_interval=FLUSH_MAX_DELAY,
+    flush_threshold=FLUSH_MAX_KEYS,
+    batch_size=FLUSH_BATCH_SIZE,
+)
+# Общий лимит бота делится между воркерами. Лимит на чат, как и отсев повторных update_id, свой в каждом процессе,
+# поэтому в один чат может уйти до WORKERS × OUTBOUND_CHAT_RATE вызовов в секунду
+outbound = OutboundScheduler(
+    global_rate=OUTBOUND_GLOBAL_RATE / max(1, WORKERS),
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    max_in_flight=OUTBOUND_MAX_IN_FLIGHT,
+    yield_after=OUTBOUND_YIELD_AFTER,
+)
+chart_renderer = ChartRenderer()
+chart_cache = ChartCache(max_entries=CHART_CACHE_SIZE)
+# Дневные итоги счётчиков для статистики; строится из actions при первом /stats_counter счётчика
+daily_index = DailyIndex()
+
+REGISTRY.callback("journal_pending_entries", "Записи журнала, ещё не перенесённые в Supabase", "gauge", lambda: journal.pending)
+for lane in LANES:
+    REGISTRY.callback(f"telegram_outbound_queue_{lane}", f"Исходящие вызовы в полосе {lane}", "gauge", lambda lane=lane: outbound.depth(lane))
+REGISTRY.callback("journal_replay_failures", "Подряд неудачные попытки переноса журнала", "gauge", lambda: journal.failures)
+
+def today_str() -> str:
+    return datetime.now(ZoneInfo("Asia/Yekaterinburg")).strftime("%Y-%m-%d")
+
+def today_ordinal() -> int:
+    return date.fromisoformat(today_str()).toordinal()
+
+# Реестр восстанавливается из снимка (настройки счётчиков и итоги за дни до registry.before),
+# затем одним постраничным проходом догружаются строки actions начиная с registry.before
+# и добавляются записи журнала, которые ещё не удалось перенести в actions.
+# После загрузки граница снимка переносится на сегодня или на самый ранний день из журнала.
 async def load_initial_data():
+    global registry
     try:
         logger.info("Начало загрузки начальных данных из Supabase")
-        data = supabase.table("actions").select("*").execute().data
-        bot_data["friend_count"] = sum(row["count"] for row in data if row["user_id"] == FRIEND_ID)
-        bot_data["my_count"] = sum(row["count"] for row in data if row["user_id"] == MY_ID)
-        logger.info(f"Данные восстановлены: Мой счёт = {bot_data['my_count']}, Счёт друга = {bot_data['friend_count']}")
+        with startup_phase("snapshot_load"):
+            payload = load_snapshot(SNAPSHOT_PATH)
+            if payload is not None:
+                try:
+                    registry = CounterRegistry.from_snapshot(payload)
+                    logger.info(f"Снимок загружен: {len(registry)} счётчик(ов) на {registry.before}")
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Снимок счётчиков не подходит и будет проигнорирован: {str(e)}")
+        today = today_str()
+        # Строки за дни из журнала ещё изменятся в actions, поэтому в base их включать нельзя
+        pending = await journal.pending_deltas()
+        before = min([today, *(key[3] for key in pending)])
+        # Итоги копятся отдельно и применяются только после полного прохода: если чтение оборвётся,
+        # реестр останется согласован со своей границей registry.before
+        recent, older = {}, {}
+        if len(registry):
+            rows = 0
+            with startup_phase("catch_up"):
+                async for row in store.iter_range(start=registry.before):
+                    if registry.get(row["chat_id"], row["thread_id"]) is None:
+                        continue
+                    rows += 1
+                    key = (row["chat_id"], row["thread_id"], row["user_id"])
+                    recent[key] = recent.get(key, 0) + row["count"]
+                    if row["date"] < before:
+                        older[key] = older.get(key, 0) + row["count"]
+            logger.info(f"Догружено строк actions: {rows}")
+        for (chat_id, thread_id, user_id, _), delta in pending.items():
+            key = (chat_id, thread_id, user_id)
+            recent[key] = recent.get(key, 0) + delta
+        for (chat_id, thread_id, user_id), count in recent.items():
+            counter = registry.get(chat_id, thread_id)
+            if counter is not None:
+                counter.counts[user_id] = counter.counts.get(user_id, 0) + count
+        for (chat_id, thread_id, user_id), count in older.items():
+            counter = registry.get(chat_id, thread_id)
+            counter.base[user_id] = counter.base.get(user_id, 0) + count
+        if pending:
+            logger.warning(f"К счётчикам добавлены неперенесённые записи журнала: {len(pending)} ключ(ей)")
+        registry.before = date.fromisoformat(before)
+        with startup_phase("snapshot_save"):
+            await save_registry()
+        for counter in registry:
+            logger.info(f"Счётчик {counter.key} восстановлен: {counter.button_text()}")
     except Exception as e:
         logger.error(f"Ошибка загрузки данных: {str(e)}", exc_info=True)
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-async def safe_edit_message(context, chat_id, msg_id, text, reply_markup=None):
-    logger.info(f"Редактирование сообщения {msg_id} в чате {chat_id}")
-    await context.bot.edit_message_text(
-        chat_id=chat_id,
-        message_id=msg_id,
-        text=text,
-        reply_markup=reply_markup
+async def save_registry() -> None:
+    if not is_owner:
+        return
+    try:
+        await asyncio.to_thread(save_snapshot, SNAPSHOT_PATH, registry.to_snapshot())
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить снимок счётчиков: {str(e)}")
+
+# Итоги нового счётчика: base – до registry.before, counts – вся история
+async def load_counter(counter: Counter) -> None:
+    before = registry.before
+    base, recent = await asyncio.gather(
+        store.totals(end=before, chat_id=counter.chat_id, thread_id=counter.thread_id),
+        store.totals(start=before, chat_id=counter.chat_id, thread_id=counter.thread_id),
     )
+    for (_, _, user_id), count in base.items():
+        counter.base[user_id] = count
+        counter.counts[user_id] = counter.counts.get(user_id, 0) + count
+    for (_, _, user_id), count in recent.items():
+        counter.counts[user_id] = counter.counts.get(user_id, 0) + count
+
+# ------------- Общее состояние воркеров -------------
+
+# Публикует настройки счётчика (и его итоги, если они ещё неизвестны) для остальных воркеров
+async def publish_counter(counter: Counter) -> None:
+    if WORKERS > 1:
+        await journal.publish([(counter.to_dict(), dict(counter.counts))])
+
+# Применяет изменения других воркеров: новые счётчики, участников, сообщение и итоги.
+# Владелец ставит правку сообщений изменившихся счётчиков и сохраняет снимок при смене настроек.
+async def apply_shared_changes(payloads: list, totals: list) -> None:
+    changed = {}
+    for raw in payloads:
+        counter = registry.get(raw["chat_id"], raw["thread_id"])
+        if counter is None:
+            counter = registry.register(Counter.from_dict(raw))
+            changed[counter.key] = counter
+        elif counter.update_config(raw):
+            changed[counter.key] = counter
+    per_counter = {}
+    for chat_id, thread_id, user_id, count in totals:
+        per_counter.setdefault((chat_id, thread_id), {})[user_id] = count
+    today = today_ordinal()
+    for (chat_id, thread_id), counts in per_counter.items():
+        counter = registry.get(chat_id, thread_id)
+        if counter is None:
+            continue
+        previous = dict(counter.counts)
+        if counter.set_counts(counts):
+            changed[counter.key] = counter
+            # Приращения других воркеров всегда относятся к сегодняшнему дню
+            for user_id, count in counts.items():
+                daily_index.add(counter.key, user_id, today, count - previous.get(user_id, 0))
+    if is_owner:
+        for counter in changed.values():
+            if counter.msg_id:
+                counter_editor.request(counter.chat_id, counter.msg_id, counter.button_text)
+        if payloads:
+            await save_registry()
+
+shared_sync = SharedStateSync(journal, apply_shared_changes, interval=WORKER_SYNC_INTERVAL)
+
+# Счётчик для команды: счётчик этой темы, а вне темы – единственный счётчик чата
+def find_counter(update: Update):
+    chat_id = update.effective_chat.id
+    thread_id = update.effective_message.message_thread_id if update.effective_message else None
+    counter = registry.get(chat_id, thread_id)
+    if counter is None:
+        in_chat = registry.in_chat(chat_id)
+        if len(in_chat) == 1:
+            counter = in_chat[0]
+    return counter
+
+# Одна попытка правки; повторы после RetryAfter и сетевых ошибок выполняет планировщик исходящих вызовов
+async def safe_edit_message(context, chat_id, msg_id, text, reply_markup=None):
+    logger.info("Редактирование сообщения %s в чате %s", msg_id, chat_id, extra={"event": "edit"})
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        await context.bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=msg_id,
+            text=text,
+            reply_markup=reply_markup
+        )
+    except RetryAfter:
+        outcome = "retry_after"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        EDIT_LATENCY.labels(outcome=outcome).observe(time.perf_counter() - started)
+
+# Ответ в чат обновления через полосу ответов планировщика
+async def reply(update: Update, text: str, **kwargs):
+    return await outbound.submit(REPLY, update.effective_chat.id, lambda: update.effective_message.reply_text(text, **kwargs))
 
 @app.route('/health')
 async def health():
     logger.info("Health check вызван")
     return 'OK', 200
 
+@app.route('/metrics')
+async def metrics():
+    return REGISTRY.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route('/<path:path>', methods=['GET'])
 async def catch_all(path):
     logger.info(f"Получен GET запрос на /{path}")
@@ -108,7 +348,7 @@ async def catch_all(path):
 @app.route('/telegram', methods=['POST'])
 @app.route('/telegram/', methods=['POST'])
 async def telegram_webhook():
-    logger.info("Получен запрос на /telegram")
+    logger.info("Получен запрос на /telegram", extra={"event": "webhook"})
     if application is None:
         logger.error("Бот ещё не инициализирован.")
         return 'Server Error', 500
@@ -117,16 +357,88 @@ async def telegram_webhook():
         return 'Forbidden', 403
     try:
         json_data = await request.get_json()
-        logger.info(f"Получены данные от Telegram: {json_data}")
-        update = Update.de_json(json_data, application.bot)
-        logger.info(f"Преобразовано обновление: {update}")
-        await application.process_update(update)
-        logger.info("Обновление успешно обработано")
+        logger.debug("Получены данные от Telegram: %s", json_data)
+        # Обработка идёт в фоне: Telegram получает ответ сразу, не дожидаясь Supabase и графиков
+        if not update_queue.put_nowait(json_data):
+            return 'Queue Full', 503
         return 'OK', 200
     except Exception as e:
         logger.error(f"Ошибка в вебхуке: {str(e)}", exc_info=True)
         return 'Server Error', 500
 
+async def process_raw_update(json_data: dict) -> None:
+    started = time.perf_counter()
+    message = json_data.get("message") or json_data.get("edited_message") or {}
+    # Поля попадают во все записи лога, сделанные при обработке этого обновления
+    token = log_context.set({
+        "update_id": json_data.get("update_id"),
+        "chat": message.get("chat", {}).get("id"),
+        "thread_id": message.get("message_thread_id"),
+        "user": message.get("from", {}).get("id"),
+    })
+    try:
+        update = Update.de_json(json_data, application.bot)
+        logger.debug("Преобразовано обновление: %s", update)
+        await application.process_update(update)
+        logger.info(
+            "Обновление успешно обработано",
+            extra={"event": "update_done", "duration_ms": round((time.perf_counter() - started) * 1000, 2)},
+        )
+    finally:
+        log_context.reset(token)
+
+update_queue = UpdateQueue(process_raw_update, workers=WEBHOOK_WORKERS, max_size=WEBHOOK_QUEUE_SIZE)
+
+REGISTRY.callback("updates_processed_total", "Обработанные обновления", "counter", lambda: update_queue.processed)
+REGISTRY.callback("updates_failed_total", "Обновления, обработка которых завершилась ошибкой", "counter", lambda: update_queue.failed)
+REGISTRY.callback("updates_dropped_total", "Обновления, отклонённые из-за переполнения очереди", "counter", lambda: update_queue.dropped)
+REGISTRY.callback("updates_duplicate_total", "Повторные доставки обновлений", "counter", lambda: update_queue.duplicates)
+REGISTRY.callback("update_queue_depth", "Обновления в очереди", "gauge", lambda: update_queue.depth)
+REGISTRY.callback("updates_in_flight", "Обновления в обработке", "gauge", lambda: update_queue.in_flight)
+
+@app.route('/queue_stats', methods=['GET'])
+async def queue_stats():
+    return update_queue.stats(), 200
+
+# Выгрузка actions для аналитики: CSV или NDJSON потоком, фильтры и курсор since – см. export.parse_export_params.
+# Для инкрементальной выгрузки следующий since – наибольший updated_at из полученных строк.
+@app.route('/export', methods=['GET'])
+async def export_actions():
+    if not EXPORT_TOKEN:
+        return 'Not Found', 404
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), EXPORT_TOKEN.encode()):
+        logger.warning("Неверный токен выгрузки")
+        return 'Unauthorized', 401, {'WWW-Authenticate': 'Bearer'}
+    try:
+        params = parse_export_params(request.args)
+    except ValueError as e:
+        return str(e), 400
+    logger.info(f"Выгрузка actions: {params}")
+
+    async def body():
+        try:
+            async for chunk in encode_rows(
+                store.iter_export(**params.query()),
+                params.format,
+                chunk_rows=store.page_size,
+                on_rows=EXPORT_ROWS.labels(format=params.format).inc,
+            ):
+                yield chunk
+        except Exception as e:
+            # Заголовки уже отправлены: клиент увидит оборванный ответ
+            logger.error(f"Ошибка выгрузки actions: {str(e)}", exc_info=True)
+            raise
+
+    response = Response(
+        body(),
+        content_type=CONTENT_TYPES[params.format],
+        headers={'Content-Disposition': f'attachment; filename="actions.{params.format}"'},
+    )
+    # Большая выгрузка может идти дольше стандартного таймаута ответа Quart
+    response.timeout = None
+    return response
+
 @app.route('/telegram', methods=['GET'])
 @app.route('/telegram/', methods=['GET'])
 async def telegram_webhook_get():
@@ -148,107 +460,189 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             "Привет! Я бот-счётчик.\n\n"
             "Доступные команды:\n"
             "• /start_actions – запустить счётчик (команда должна вызываться в теме супергруппы)\n"
-            "• /edit_count <friend|me> <число> – изменить счётчик вручную\n"
-            "• /stats_counter [week|month|all] – показать статистику\n"
+            "• /join_counter – участвовать в счётчике этой темы\n"
+            "• /edit_count <me|friend|имя|id> <число> – изменить счётчик вручную\n"
+            "• /stats_counter [week|month|all|30d|2024-01-01..2024-01-31] [day|week|month] – показать статистику\n"
+            "• /streak_counter – серии дней подряд\n"
             "• /help_counter – помощь"
         )
-        await update.effective_message.reply_text(text)
+        await reply(update, text)
         logger.info("Приветственное сообщение отправлено")
     except Exception as e:
         logger.error(f"Ошибка в /start: {str(e)}", exc_info=True)
 
-# /start_actions – запускает счётчик, отправляя сообщение с текстом "Счётчик" и единственной кнопкой с текущим счётом
+# /start_actions – запускает счётчик темы, отправляя сообщение с текстом "Счётчик" и единственной кнопкой с текущим счётом
 async def start_actions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Команда /start_actions вызвана")
     try:
         thread_id = update.message.message_thread_id if update.message else None
         if thread_id is None:
             logger.warning("Команда /start_actions должна вызываться в теме супергруппы")
-            await update.effective_message.reply_text("Это не тема супергруппы. Используйте эту команду в теме!")
+            await reply(update, "Это не тема супергруппы. Используйте эту команду в теме!")
             return
 
-        bot_data.setdefault("friend_count", 0)
-        bot_data.setdefault("my_count", 0)
-        bot_data["thread_id"] = thread_id
-        bot_data["actions_chat_id"] = update.effective_chat.id
+        chat_id = update.effective_chat.id
+        counter = registry.get(chat_id, thread_id)
+        if counter is None:
+            participants = dict(DEFAULT_PARTICIPANTS)
+            user = update.effective_user
+            participants.setdefault(user.id, user.first_name or str(user.id))
+            created = Counter(chat_id, thread_id, participants)
+            # Блокировка берётся до регистрации: сообщения ждут, пока загрузятся итоги
+            async with created.lock:
+                counter = registry.register(created)
+                if counter is created:
+                    try:
+                        await load_counter(counter)
+                        # Итоги публикуются под той же блокировкой: приращение, записанное в журнал раньше
+                        # публикации, создало бы в общих итогах строку с одной дельтой вместо полной суммы
+                        await publish_counter(counter)
+                    except Exception:
+                        # Счётчик без истории нельзя оставлять: его base ушёл бы в снимок пустым
+                        registry.unregister(counter)
+                        raise
+                    logger.info(f"Создан счётчик {counter.key} с участниками {list(participants)}")
 
         # Отправляем сообщение с текстом "Счётчик" и встроенной кнопкой с текущим счётом (например, "0/0")
-        counter_text = f"{bot_data['friend_count']}/{bot_data['my_count']}"
-        keyboard = [[InlineKeyboardButton(counter_text, callback_data="none")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        msg = await update.effective_message.reply_text(
+        counter_text = counter.button_text()
+        msg = await reply(update,
             "Счётчик",
-            reply_markup=reply_markup,
+            reply_markup=counter_markup(counter_text),
             message_thread_id=thread_id
         )
-        bot_data["actions_msg_id"] = msg.message_id
+        counter.msg_id = msg.message_id
+        counter_editor.mark_sent(msg.chat_id, msg.message_id, counter_text)
+        await publish_counter(counter)
+        await save_registry()
         logger.info(f"Сообщение-счётчик отправлено, ID: {msg.message_id}")
     except Exception as e:
         logger.error(f"Ошибка в /start_actions: {str(e)}", exc_info=True)
 
+# /join_counter – добавляет вызвавшего в участники счётчика этой темы
+async def join_counter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.info("Команда /join_counter вызвана")
+    try:
+        thread_id = update.effective_message.message_thread_id if update.effective_message else None
+        counter = registry.get(update.effective_chat.id, thread_id)
+        if counter is None:
+            await reply(update, "В этой теме счётчик не запущен. Используйте /start_actions.")
+            return
+        user = update.effective_user
+        async with counter.lock:
+            added = counter.add_participant(user.id, user.first_name or str(user.id))
+        if not added:
+            await reply(update, "Вы уже участвуете в счётчике.")
+            return
+        await publish_counter(counter)
+        await save_registry()
+        await update_counter_message(counter)
+        await reply(update, f"{user.first_name or user.id} теперь в счётчике.")
+    except Exception as e:
+        logger.error(f"Ошибка в /join_counter: {str(e)}", exc_info=True)
+
 # /edit_count – изменение счётчика вручную (через слэш-команду)
+@timed(HANDLER_LATENCY.labels(handler="edit_count"))
 async def edit_count(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Команда /edit_count вызвана")
     try:
         args = context.args
         if len(args) < 2:
-            await update.effective_message.reply_text("Формат: /edit_count <friend|me> <число>")
+            await reply(update, "Формат: /edit_count <me|friend|имя|id> <число>")
             return
-        who = args[0].lower()
         try:
             delta = int(args[1])
         except ValueError:
-            await update.effective_message.reply_text("Второй аргумент должен быть числом.")
+            await reply(update, "Второй аргумент должен быть числом.")
             return
-        async with data_lock:
-            if who == "friend":
-                bot_data["friend_count"] += delta
-            elif who == "me":
-                bot_data["my_count"] += delta
-            else:
-                await update.effective_message.reply_text("Первый аргумент должен быть 'friend' или 'me'.")
-                return
-        logger.info(f"Счётчик изменён: Мой счёт = {bot_data['my_count']}, Счёт друга = {bot_data['friend_count']}")
-        await update_counter_message(context)
+        counter = find_counter(update)
+        if counter is None:
+            await reply(update, "В этом чате счётчик не запущен.")
+            return
+        user_id = counter.resolve(args[0], update.effective_user.id)
+        if user_id is None:
+            await reply(update, "Первый аргумент должен быть 'me', 'friend', именем или id участника.")
+            return
+        # Ручная правка записывается в сегодняшнюю строку, чтобы пережить перезапуск
+        if delta:
+            await record_increment(counter, user_id, delta)
+        logger.info(f"Счётчик {counter.key} изменён: {counter.button_text()}")
+        await update_counter_message(counter)
     except Exception as e:
         logger.error(f"Ошибка в /edit_count: {str(e)}", exc_info=True)
 
 # /stats_counter – получение статистики и отправка графика (в том же треде, если есть)
+@timed(HANDLER_LATENCY.labels(handler="stats_counter"))
 async def stats_counter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Команда /stats_counter вызвана")
     try:
         args = context.args
-        period = "week"
-        if args:
-            period = args[0]
-
-        all_data = supabase.table("actions").select("user_id, date, count").execute().data
-        logger.info(f"Общее количество записей: {len(all_data)}")
-        if period == "week":
-            start_date = datetime.now() - timedelta(days=7)
-            filtered = [rec for rec in all_data if datetime.strptime(rec["date"], "%Y-%m-%d") >= start_date]
-        elif period == "month":
-            start_date = datetime.now().replace(day=1)
-            filtered = [rec for rec in all_data if datetime.strptime(rec["date"], "%Y-%m-%d") >= start_date]
-        else:
-            filtered = all_data
+        period = args[0] if args else "week"
+        granularity = args[1] if len(args) > 1 else "day"
+        if granularity not in GRANULARITIES:
+            await reply(update, "Группировка: day, week или month.")
+            return
+        today = today_ordinal()
+        bounds = parse_period(period, today)
+        if bounds is None:
+            await reply(update, f"Период: week, month, all, число дней (30d) или диапазон 2024-01-01..2024-01-31, не длиннее {STATS_MAX_DAYS} дн.")
+            return
 
-        filtered = [rec for rec in filtered if rec["user_id"] in [FRIEND_ID, MY_ID]]
-        logger.info(f"Записей после фильтрации: {len(filtered)}")
-        df = pd.DataFrame(filtered)
-        df_hash = df.to_json(orient='split')
-        plot_buf = await generate_plot_cached(df_hash, period)
+        counter = find_counter(update)
+        if counter is None:
+            await reply(update, "В этом чате счётчик не запущен.")
+            return
+        # Ключ фиксируется до чтения данных: изменения после этого момента получат новую версию
+        cache_key = (counter.key, period, granularity, today, counter.version)
         thread_id = update.effective_message.message_thread_id if update.effective_message else None
-        await context.bot.send_photo(
-            chat_id=update.effective_chat.id,
-            photo=plot_buf,
-            caption=f"📊 Статистика за {period}",
-            message_thread_id=thread_id
-        )
+        entry = chart_cache.get(cache_key)
+        if entry is not None:
+            logger.info(f"График {cache_key} взят из кеша")
+        else:
+            days = await counter_days(counter)
+            labels, series = index_chart_series(days, counter.chart_users(), *bounds, granularity)
+            if not labels:
+                await reply(update, "За этот период данных нет.")
+                return
+            entry = chart_cache.put(cache_key, await generate_plot(series, labels))
+        await send_chart(context, update.effective_chat.id, thread_id, entry, f"📊 Статистика за {period}")
         logger.info("Фото со статистикой отправлено")
     except Exception as e:
         logger.error(f"Ошибка в /stats_counter: {str(e)}", exc_info=True)
 
+# /streak_counter – текущие и самые длинные серии дней подряд для каждого участника
+async def streak_counter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.info("Команда /streak_counter вызвана")
+    try:
+        counter = find_counter(update)
+        if counter is None:
+            await reply(update, "В этом чате счётчик не запущен.")
+            return
+        days = await counter_days(counter)
+        today = today_ordinal()
+        lines = []
+        for user_id, label in counter.participants.items():
+            current, longest = streaks(days.values(user_id, days.origin, today + 1))
+            lines.append(f"{label}: сейчас {current} дн. подряд, рекорд {longest} дн.")
+        thread_id = update.effective_message.message_thread_id if update.effective_message else None
+        await reply(update, "🔥 Серии\n" + "\n".join(lines), message_thread_id=thread_id)
+    except Exception as e:
+        logger.error(f"Ошибка в /streak_counter: {str(e)}", exc_info=True)
+
+# Отправка графика: по сохранённому file_id, если он уже есть, иначе загрузкой PNG с запоминанием file_id
+async def send_chart(context: ContextTypes.DEFAULT_TYPE, chat_id: int, thread_id, entry, caption: str) -> None:
+    if entry.file_id:
+        try:
+            await outbound.submit(CHART, chat_id, lambda: context.bot.send_photo(
+                chat_id=chat_id, photo=entry.file_id, caption=caption, message_thread_id=thread_id))
+            return
+        except BadRequest as e:
+            logger.warning(f"file_id графика больше не принимается, загружаем заново: {str(e)}")
+            entry.file_id = None
+    msg = await outbound.submit(CHART, chat_id, lambda: context.bot.send_photo(
+        chat_id=chat_id, photo=entry.png, caption=caption, message_thread_id=thread_id))
+    if msg.photo:
+        entry.file_id = msg.photo[-1].file_id
+
 # /help_counter – вывод списка команд (помощь)
 async def help_counter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.info("Команда /help_counter вызвана")
@@ -256,172 +650,185 @@ async def help_counter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         help_text = (
             "🛠️ *Помощь по боту-счетчику* 🛠️\n\n"
             "• /start_actions – запустить счётчик (команда должна вызываться в теме супергруппы)\n"
-            "• /edit_count <friend|me> <число> – изменить счётчик вручную\n"
-            "• /stats_counter [week|month|all] – показать статистику\n"
+            "• /join_counter – участвовать в счётчике этой темы\n"
+            "• /edit_count <me|friend|имя|id> <число> – изменить счётчик вручную\n"
+            "• /stats_counter [week|month|all|30d|2024-01-01..2024-01-31] [day|week|month] – показать статистику\n"
+            "• /streak_counter – серии дней подряд\n"
             "• /help_counter – помощь\n\n"
             "📌 _Примечание:_ Если бот используется в группе, убедитесь, что режим приватности отключён, или отправляйте команды с упоминанием имени бота."
         )
         thread_id = update.effective_message.message_thread_id if update.effective_message else None
-        await update.effective_message.reply_text(help_text, parse_mode="Markdown", message_thread_id=thread_id)
+        await reply(update, help_text, parse_mode="Markdown", message_thread_id=thread_id)
         logger.info("Ответ на /help_counter отправлен")
     except Exception as e:
         logger.error(f"Ошибка в /help_counter: {str(e)}", exc_info=True)
 
-# Функция обновления сообщения-счётчика (текст всегда "Счётчик", а кнопка отображает текущие значения)
-async def update_counter_message(context: ContextTypes.DEFAULT_TYPE) -> None:
-    logger.info("Обновление сообщения-счётчика")
+def counter_markup(button_text: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton(button_text, callback_data="none")]])
+
+async def _edit_counter(chat_id: int, msg_id: int, button_text: str) -> None:
+    # Текст сообщения остаётся неизменным – "Счётчик"
+    await outbound.submit(EDIT, chat_id, lambda: safe_edit_message(application, chat_id, msg_id, "Счётчик", counter_markup(button_text)))
+    logger.info("Сообщение-счётчик успешно обновлено", extra={"event": "edit"})
+
+counter_editor = CounterEditor(_edit_counter, window=COUNTER_EDIT_WINDOW)
+
+# Функция обновления сообщения-счётчика (текст всегда "Счётчик", а кнопка отображает текущие значения).
+# Правка только ставится в очередь: частые обновления склеиваются в одно с последним значением.
+# Сообщения правит только владелец: изменения остальных воркеров он получает через общее состояние.
+async def update_counter_message(counter: Counter) -> None:
+    if not is_owner:
+        return
+    if not counter.msg_id:
+        logger.warning(f"Для счётчика {counter.key} не установлено сообщение")
+        return
+    counter_editor.request(counter.chat_id, counter.msg_id, counter.button_text)
+
+# Приращение в памяти и в журнале. Обработчик ждёт только локального коммита журнала,
+# запись в Supabase уходит пачкой из проигрывателя; откат возможен лишь при ошибке самого журнала.
+async def record_increment(counter: Counter, user_id: int, delta: int) -> None:
+    day = today_str()
+    ordinal = date.fromisoformat(day).toordinal()
+    async with counter.lock:
+        counter.add(user_id, delta)
+        daily_index.add(counter.key, user_id, ordinal, delta)
     try:
-        chat_id = bot_data["actions_chat_id"]
-        msg_id = bot_data["actions_msg_id"]
-        if not chat_id or not msg_id:
-            logger.warning("Не установлены chat_id или msg_id для обновления")
-            return
-        button_text = f"{bot_data['friend_count']}/{bot_data['my_count']}"
-        keyboard = [[InlineKeyboardButton(button_text, callback_data="none")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        # Текст сообщения остаётся неизменным – "Счётчик"
-        await safe_edit_message(context, chat_id, msg_id, "Счётчик", reply_markup)
-        logger.info("Сообщение-счётчик успешно обновлено")
-    except BadRequest as e:
-        logger.error(f"Не удалось обновить сообщение: {str(e)}")
-    except Exception as e:
-        logger.error(f"Ошибка в update_counter_message: {str(e)}", exc_info=True)
+        await journal.append((counter.chat_id, counter.thread_id, user_id, day), delta)
+    except Exception:
+        async with counter.lock:
+            counter.add(user_id, -delta)
+            daily_index.add(counter.key, user_id, ordinal, -delta)
+        raise
 
-# Обработчик входящих сообщений для автоматического подсчёта (если пишут в нужном треде)
+# Обработчик входящих сообщений для автоматического подсчёта (если пишут в теме с запущенным счётчиком)
+@timed(HANDLER_LATENCY.labels(handler="count_messages"))
 async def count_messages(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logger.info("Входящее сообщение для подсчёта получено")
     try:
         if update.message is None:
             logger.debug("update.message отсутствует")
             return
-        if not bot_data["thread_id"]:
-            logger.debug("thread_id не установлен")
-            return
-        if update.message.message_thread_id != bot_data["thread_id"]:
-            logger.debug("Сообщение не из нужной темы")
+        counter = registry.get(update.effective_chat.id, update.message.message_thread_id)
+        if counter is None and journal.shared:
+            # Счётчик мог запустить другой воркер уже после нашей последней синхронизации
+            await shared_sync.poll()
+            counter = registry.get(update.effective_chat.id, update.message.message_thread_id)
+        if counter is None:
+            logger.debug("Сообщение не из темы со счётчиком")
             return
 
         user_id = update.effective_user.id
-        today = datetime.now(ZoneInfo("Asia/Yekaterinburg")).strftime("%Y-%m-%d")
-        if user_id not in [FRIEND_ID, MY_ID]:
-            logger.debug(f"Сообщение от неизвестного пользователя: {user_id}")
+        if user_id not in counter.participants:
+            logger.debug("Сообщение от неизвестного пользователя: %s", user_id)
             return
 
-        async with data_lock:
-            if user_id == FRIEND_ID:
-                bot_data["friend_count"] += 1
-            else:
-                bot_data["my_count"] += 1
-            logger.info(f"Обновлены счётчики: Мой счёт = {bot_data['my_count']}, Счёт друга = {bot_data['friend_count']}")
-
-        try:
-            existing = supabase.table('actions') \
-                .select("count") \
-                .eq("user_id", user_id) \
-                .eq("date", today) \
-                .execute().data
-            if existing and len(existing) > 0:
-                new_count = existing[0]['count'] + 1
-                _ = supabase.table('actions') \
-                    .update({"count": new_count}) \
-                    .eq("user_id", user_id) \
-                    .eq("date", today) \
-                    .execute()
-            else:
-                _ = supabase.table('actions') \
-                    .insert({"user_id": user_id, "date": today, "count": 1}) \
-                    .execute()
-            logger.info("Данные в Supabase обновлены")
-        except Exception as e:
-            async with data_lock:
-                if user_id == FRIEND_ID:
-                    bot_data["friend_count"] -= 1
-                else:
-                    bot_data["my_count"] -= 1
-            logger.error(f"Ошибка Supabase: {str(e)}")
-            raise
-
-        await update_counter_message(context)
-        logger.info("Сообщение с обновленным счётчиком отправлено")
+        await record_increment(counter, user_id, 1)
+        await update_counter_message(counter)
+        logger.info("Обновлён счётчик %s: %s", counter.key, counter.button_text(), extra={"event": "counted"})
     except Exception as e:
         logger.error(f"Ошибка обработки сообщения: {str(e)}", exc_info=True)
 
-# Функция генерации графика (оставляем без изменений)
-async def generate_plot(df: pd.DataFrame, period: str) -> BytesIO:
-    logger.info("Начало генерации графика")
-    fig, ax = plt.subplots(figsize=(12, 6))
+GRANULARITIES = ("day", "week", "month")
+LABEL_FORMATS = {"day": "%d.%m", "week": "%d.%m", "month": "%m.%Y"}
+
+# Границы периода статистики [start, end) в ordinal; start None – вся история, None – период не распознан
+# или длиннее STATS_MAX_DAYS. Неделя – сегодня и шесть предыдущих дней, "30d" – последние 30 дней,
+# "2024-01-01..2024-01-31" – диапазон включительно. Дни после сегодняшнего отбрасываются.
+def parse_period(period: str, today: int):
+    if period == "week":
+        return today - 6, today + 1
+    if period == "month":
+        return date.fromordinal(today).replace(day=1).toordinal(), today + 1
+    if period == "all":
+        return None, today + 1
+    if period.endswith("d") and period[:-1].isdigit():
+        days = int(period[:-1])
+        return (today - days + 1, today + 1) if 0 < days <= STATS_MAX_DAYS else None
+    first, sep, last = period.partition("..")
+    if not sep:
+        return None
     try:
-        if df.empty:
-            ax.text(0.5, 0.5, 'Нет данных за выбранный период', ha='center', va='center', fontsize=14)
-            ax.set_title("Аналитика действий", fontsize=16)
-            ax.set_xlabel("Дата", fontsize=14)
-            ax.set_ylabel("Количество действий", fontsize=14)
-            buf = BytesIO()
-            plt.tight_layout()
-            plt.savefig(buf, format='png', bbox_inches='tight', dpi=120)
-            buf.seek(0)
-            plt.close()
-            logger.info("График с отсутствием данных сгенерирован")
-            return buf
-
-        df['date'] = pd.to_datetime(df['date'])
-        df_grouped = df.groupby(['user_id', 'date'])['count'].sum().unstack(level=0).fillna(0)
-        all_dates = pd.date_range(df['date'].min(), df['date'].max())
-        df_grouped = df_grouped.reindex(all_dates, fill_value=0)
-
-        dates = df_grouped.index
-        yan = df_grouped.get(MY_ID, pd.Series(0, index=dates))
-        egor = df_grouped.get(FRIEND_ID, pd.Series(0, index=dates))
-
-        bar_width = 0.35
-        x = np.arange(len(dates))
-        ax.bar(x - bar_width/2, yan, bar_width, label='Ян', color='#3498db', alpha=0.7)
-        ax.bar(x + bar_width/2, egor, bar_width, label='Егор', color='#2ecc71', alpha=0.7)
-
-        if len(dates) >= 3:
-            window = min(3, len(dates))
-            ax.plot(x, yan.rolling(window).mean(), color='#2980b9', linestyle='--', label='Тренд Ян')
-            ax.plot(x, egor.rolling(window).mean(), color='#27ae60', linestyle='--', label='Тренд Егор')
-
-        ax.set_xticks(x)
-        ax.set_xticklabels([d.strftime("%d.%m") for d in dates], rotation=45)
-        ax.set_title("Аналитика действий", fontsize=16)
-        ax.set_xlabel("Дата", fontsize=14)
-        ax.set_ylabel("Количество действий", fontsize=14)
-        ax.legend()
-        ax.grid(True, linestyle='--', alpha=0.7)
-        fig.autofmt_xdate()
-    except Exception as e:
-        ax.clear()
-        ax.text(0.5, 0.5, 'Ошибка генерации графика', ha='center', va='center', fontsize=14, color='red')
-        logger.error(f"Ошибка генерации графика: {str(e)}")
-    finally:
-        buf = BytesIO()
-        plt.tight_layout()
-        plt.savefig(buf, format='png', bbox_inches='tight', dpi=120)
-        buf.seek(0)
-        plt.close()
-        logger.info("График сгенерирован")
-        return buf
-
-# Здесь убираем декоратор кэширования, чтобы график всегда генерировался заново
-async def generate_plot_cached(df_hash: str, period: str) -> BytesIO:
-    logger.info("Вызов функции генерации графика (без кеширования)")
+        start, end = date.fromisoformat(first).toordinal(), date.fromisoformat(last).toordinal() + 1
+    except ValueError:
+        return None
+    end = min(end, today + 1)
+    return (start, end) if start < end and end - start <= STATS_MAX_DAYS else None
+
+# Индекс дней счётчика; при первом обращении строится постраничным чтением его строк actions,
+# каждая страница сразу добавляется в массивы индекса
+async def counter_days(counter: Counter):
+    days = daily_index.get(counter.key)
+    if days is None:
+        days = CounterDays(today_ordinal(), 1)
+        async for row in store.iter_range(chat_id=counter.chat_id, thread_id=counter.thread_id):
+            DailyIndex.add_row(days, row)
+        # Пока шло чтение, индекс мог построить параллельный запрос
+        days = daily_index.get(counter.key) or daily_index.register(counter.key, days, dict(counter.counts), today_ordinal())
+    return days
+
+# Ряды графика из индекса: срезы массивов за период и при необходимости суммы по неделям или месяцам
+def index_chart_series(days, chart_users: list, start, end: int, granularity: str) -> tuple:
+    start = days.origin if start is None else max(start, days.origin)
+    start = min(start, end)
+    bucket_starts, series = [], []
+    for user_id, label, color, trend in chart_users:
+        bucket_starts, values = rollup(days.values(user_id, start, end), start, granularity)
+        series.append((label, color, trend, values))
+    labels = [date.fromordinal(day).strftime(LABEL_FORMATS[granularity]) for day in bucket_starts]
+    return labels, series
+
+# Генерация графика выполняется в пуле процессов и не блокирует event loop
+async def generate_plot(series: list, labels: list) -> bytes:
+    logger.info("Начало генерации графика")
+    started = time.perf_counter()
+    outcome = "ok"
     try:
-        df = pd.read_json(df_hash, orient='split')
-        return await generate_plot(df, period)
-    except Exception as e:
-        logger.error(f"Ошибка в функции генерации графика: {str(e)}")
+        with RENDER_IN_FLIGHT.track_inprogress():
+            png = await chart_renderer.render(series, labels)
+    except asyncio.TimeoutError:
+        outcome = "timeout"
         raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        RENDER_LATENCY.labels(outcome=outcome).observe(time.perf_counter() - started)
+    logger.info("График сгенерирован")
+    return png
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error(f"Ошибка: {context.error}", exc_info=True)
     if isinstance(context.error, TelegramError):
         logger.error(f"Детали ошибки Telegram: {context.error.message}")
 
-async def main():
-    global application
+# Регистрируем слэш-команды
+def register_handlers(application) -> None:
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("start_actions", start_actions))
+    application.add_handler(CommandHandler("join_counter", join_counter))
+    application.add_handler(CommandHandler("edit_count", edit_count))
+    application.add_handler(CommandHandler("stats_counter", stats_counter))
+    application.add_handler(CommandHandler("streak_counter", streak_counter))
+    application.add_handler(CommandHandler("help_counter", help_counter))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, count_messages))
+    application.add_error_handler(error_handler)
+
+# worker_index и sock_fd заданы в режиме нескольких воркеров (см. run_worker), generation – номер запуска
+async def main(worker_index=None, sock_fd=None, generation=None):
+    global application, is_owner
     logger.info("Инициализация бота")
+    shared = worker_index is not None
+    if shared:
+        is_owner = try_acquire_owner(f"{JOURNAL_PATH}.owner") is not None
+        journal.shared = True
+        logger.info(f"Воркер {worker_index} (pid {os.getpid()}): {'владелец' if is_owner else 'обработчик'}")
+    # Процессы рендеринга создаются до запуска остальных фоновых задач
+    if RENDER_PRESTART:
+        with startup_phase("renderer"):
+            chart_renderer.start()
+    with startup_phase("journal_open"):
+        await journal.open()
+    with startup_phase("supabase_connect"):
+        await connect_supabase()
     application = (
         ApplicationBuilder()
             .token(BOT_TOKEN)
@@ -429,35 +836,81 @@ async def main():
             .write_timeout(30)
             .build()
     )
-    await load_initial_data()
+    if is_owner:
+        # Записи, оставшиеся с прошлого запуска, переносятся до загрузки итогов
+        with startup_phase("journal_replay"):
+            await journal.flush(store)
+        await load_initial_data()
+        if shared:
+            with startup_phase("shared_publish"):
+                await journal.publish([(counter.to_dict(), dict(counter.counts)) for counter in registry], reset=True)
+                await journal.mark_ready(generation, registry.before.toordinal())
+                await shared_sync.poll()
+    else:
+        # Счётчики и итоги берутся из общего состояния, подготовленного владельцем
+        with startup_phase("shared_wait"):
+            registry.before = date.fromordinal(await journal.wait_ready(generation))
+            await shared_sync.poll()
     logger.info("Начальные данные загружены")
 
-    # Регистрируем слэш-команды
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("start_actions", start_actions))
-    application.add_handler(CommandHandler("edit_count", edit_count))
-    application.add_handler(CommandHandler("stats_counter", stats_counter))
-    application.add_handler(CommandHandler("help_counter", help_counter))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, count_messages))
-    application.add_error_handler(error_handler)
+    register_handlers(application)
     logger.info("Обработчики зарегистрированы")
 
-    await application.initialize()
-    await application.start()
+    with startup_phase("bot_start"):
+        await application.initialize()
+        await application.start()
     logger.info("Бот запущен")
 
-    await application.bot.set_webhook(
-        url=f"{APP_URL}/telegram",
-        secret_token=SECRET_TOKEN
-    )
-    logger.info("Вебхук установлен")
+    if is_owner:
+        with startup_phase("set_webhook"):
+            await application.bot.set_webhook(
+                url=f"{APP_URL}/telegram",
+                secret_token=SECRET_TOKEN
+            )
+        logger.info("Вебхук установлен")
+    report_startup()
+
+    outbound.start()
+    if is_owner:
+        journal.start(store)
+    if shared:
+        shared_sync.start()
+    update_queue.start()
 
     config = Config()
-    config.bind = [f"0.0.0.0:{PORT}"]
+    config.bind = [f"fd://{sock_fd}"] if sock_fd is not None else [f"0.0.0.0:{PORT}"]
     logger.info(f"Запуск сервера на порту {PORT}")
-    await serve(app, config)
+    try:
+        await serve(app, config)
+    finally:
+        # Дорабатываем принятые обновления и переносим журнал перед выходом
+        await update_queue.stop()
+        await shared_sync.stop()
+        await journal.stop(store if is_owner else None)
+        logger.info("Журнал счётчиков закрыт при остановке")
+        await counter_editor.close()
+        await outbound.stop()
+        await save_registry()
+        chart_renderer.shutdown()
+        await store.close()
+
+# Точка входа процесса-воркера: поток логирования не переживает fork, поэтому запускается заново
+def run_worker(worker_index: int, sock_fd: int, generation: int) -> None:
+    global log_listener
+    log_listener = setup_logging()
+    try:
+        asyncio.run(main(worker_index, sock_fd, generation))
+    except KeyboardInterrupt:
+        logger.info(f"Воркер {worker_index} остановлен")
+    except Exception as e:
+        logger.critical(f"Фатальная ошибка воркера {worker_index}: {str(e)}", exc_info=True)
+        sys.exit(1)
+    finally:
+        log_listener.stop()
 
 if __name__ == "__main__":
+    if WORKERS > 1:
+        sys.exit(run_workers(WORKERS, PORT, run_worker))
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -0,0 +1,39 @@
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ChartEntry:
+    png: bytes
+    # file_id, который Telegram вернул при первой отправке: повторно отправляем по нему без загрузки файла
+    file_id: Optional[str] = None
+
+
+# Ограниченный LRU-кеш готовых графиков. Ключ включает версию данных,
+# поэтому после любого изменения счётчиков старые записи просто перестают запрашиваться и вытесняются.
+class ChartCache:
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, ChartEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[ChartEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Hashable, png: bytes) -> ChartEntry:
+        entry = ChartEntry(png)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            logger.debug(f"График {evicted} вытеснен из кеша")
+        return entry
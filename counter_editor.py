@@ -0,0 +1,78 @@
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Tuple
+
+from telegram.error import BadRequest, RetryAfter
+
+from outbound import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+SendFn = Callable[[int, int, str], Awaitable[None]]
+RenderFn = Callable[[], str]
+
+
+# Планировщик правок сообщения-счётчика: на каждое сообщение работает не больше одной задачи,
+# которая склеивает накопившиеся запросы в последнее значение и правит сообщение не чаще раза в window секунд.
+class CounterEditor:
+    def __init__(self, send_fn: SendFn, window: float = 1.0):
+        self._send = send_fn
+        self.window = window
+        self._pending: Dict[Tuple[int, int], RenderFn] = {}
+        self._tasks: Dict[Tuple[int, int], asyncio.Task] = {}
+        self._last_text: Dict[Hashable, str] = {}
+        self._next_edit_at: Dict[Hashable, float] = {}
+
+    # Запоминает текст, уже показанный в сообщении (например, сразу после отправки)
+    def mark_sent(self, chat_id: int, msg_id: int, text: str) -> None:
+        self._last_text[(chat_id, msg_id)] = text
+
+    # Ставит правку в очередь и сразу возвращает управление; текст вычисляется в момент отправки
+    def request(self, chat_id: int, msg_id: int, render: RenderFn) -> None:
+        key = (chat_id, msg_id)
+        self._pending[key] = render
+        if key not in self._tasks:
+            # Пустой контекст: задача переживает обновление, которое её создало, и не должна нести его поля в логи
+            self._tasks[key] = asyncio.create_task(self._drain(key), context=contextvars.Context())
+
+    async def _drain(self, key: Tuple[int, int]) -> None:
+        chat_id, msg_id = key
+        try:
+            while True:
+                wait = self._next_edit_at.get(key, 0.0) - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                render = self._pending.pop(key, None)
+                if render is None:
+                    return
+                text = render()
+                if text == self._last_text.get(key):
+                    logger.debug("Текст сообщения %s не изменился, правка пропущена", msg_id)
+                    continue
+                self._next_edit_at[key] = time.monotonic() + self.window
+                try:
+                    await self._send(chat_id, msg_id, text)
+                    self._last_text[key] = text
+                except RetryAfter as e:
+                    delay = retry_after_seconds(e)
+                    logger.warning(f"Telegram просит подождать {delay} с перед правкой сообщения {msg_id}")
+                    # Повторим с самым свежим значением, если новых запросов не пришло
+                    self._pending.setdefault(key, render)
+                    self._next_edit_at[key] = time.monotonic() + delay
+                except BadRequest as e:
+                    if "not modified" in str(e).lower():
+                        self._last_text[key] = text
+                    else:
+                        logger.error(f"Не удалось обновить сообщение: {str(e)}")
+                except Exception as e:
+                    logger.error(f"Ошибка правки сообщения {msg_id}: {str(e)}", exc_info=True)
+        finally:
+            self._tasks.pop(key, None)
+
+    async def close(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
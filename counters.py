@@ -0,0 +1,170 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, thread_id) темы, в которой работает счётчик
+CounterKey = Tuple[int, int]
+
+# Цвета серий графика по порядку участников: столбцы и линия тренда
+PALETTE = [
+    ('#3498db', '#2980b9'),
+    ('#2ecc71', '#27ae60'),
+    ('#e67e22', '#d35400'),
+    ('#9b59b6', '#8e44ad'),
+    ('#e74c3c', '#c0392b'),
+    ('#1abc9c', '#16a085'),
+]
+
+
+# Разбор списка участников вида "424546089:Егор,1181433072:Ян"
+def parse_participants(spec: str) -> Dict[int, str]:
+    participants = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        user_id, _, label = item.partition(":")
+        participants[int(user_id)] = label or user_id
+    return participants
+
+
+# Состояние одного счётчика. Порядок participants задаёт порядок чисел на кнопке ("friend/my" для двоих).
+# base – итоги участников за дни до CounterRegistry.before, counts – текущие итоги.
+# Свой lock у каждого счётчика: счётчики разных чатов никогда не ждут друг друга.
+@dataclass(eq=False, slots=True)
+class Counter:
+    chat_id: int
+    thread_id: int
+    participants: Dict[int, str]
+    msg_id: Optional[int] = None
+    counts: Dict[int, int] = field(default_factory=dict)
+    base: Dict[int, int] = field(default_factory=dict)
+    # Растёт при каждом изменении данных счётчика; входит в ключ кеша графиков
+    version: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def key(self) -> CounterKey:
+        return self.chat_id, self.thread_id
+
+    def button_text(self) -> str:
+        return "/".join(str(self.counts.get(user_id, 0)) for user_id in self.participants)
+
+    def add(self, user_id: int, delta: int) -> None:
+        self.counts[user_id] = self.counts.get(user_id, 0) + delta
+        self.version += 1
+
+    # Абсолютные итоги из общего состояния воркеров; True, если что-то изменилось
+    def set_counts(self, counts: Dict[int, int]) -> bool:
+        changed = {user_id: count for user_id, count in counts.items() if self.counts.get(user_id) != count}
+        if changed:
+            self.counts.update(changed)
+            self.version += 1
+        return bool(changed)
+
+    # Участники и сообщение, изменённые другим воркером; base остаётся своим
+    def update_config(self, raw: dict) -> bool:
+        participants = {int(user_id): label for user_id, label in raw["participants"]}
+        changed = list(participants.items()) != list(self.participants.items()) or raw.get("msg_id") != self.msg_id
+        self.participants = participants
+        self.msg_id = raw.get("msg_id")
+        for user_id in participants:
+            self.counts.setdefault(user_id, 0)
+            self.base.setdefault(user_id, 0)
+        if changed:
+            self.version += 1
+        return changed
+
+    def add_participant(self, user_id: int, label: str) -> bool:
+        if user_id in self.participants:
+            return False
+        self.participants[user_id] = label
+        self.counts.setdefault(user_id, 0)
+        self.base.setdefault(user_id, 0)
+        # Новый участник меняет кнопку и график: кеш графиков должен это увидеть
+        self.version += 1
+        return True
+
+    # Кого правит /edit_count: "me" – вызвавший, "friend" – второй участник счётчика на двоих,
+    # иначе имя участника или его user_id
+    def resolve(self, who: str, caller_id: int) -> Optional[int]:
+        who = who.lower()
+        if who == "me":
+            return caller_id if caller_id in self.participants else None
+        if who == "friend":
+            others = [user_id for user_id in self.participants if user_id != caller_id]
+            return others[0] if len(others) == 1 else None
+        for user_id, label in self.participants.items():
+            if who == label.lower() or who == str(user_id):
+                return user_id
+        return None
+
+    # Серии графика: пользователь, подпись, цвет столбцов, цвет тренда
+    def chart_users(self) -> List[tuple]:
+        return [
+            (user_id, label, *PALETTE[i % len(PALETTE)])
+            for i, (user_id, label) in enumerate(self.participants.items())
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "chat_id": self.chat_id,
+            "thread_id": self.thread_id,
+            "msg_id": self.msg_id,
+            "participants": [[user_id, label] for user_id, label in self.participants.items()],
+            "base": {str(user_id): count for user_id, count in self.base.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "Counter":
+        participants = {int(user_id): label for user_id, label in raw["participants"]}
+        base = {int(user_id): int(count) for user_id, count in raw.get("base", {}).items()}
+        return cls(raw["chat_id"], raw["thread_id"], participants, msg_id=raw.get("msg_id"),
+                   counts=dict(base), base=base)
+
+
+# Реестр счётчиков по (chat_id, thread_id). before – граница, до которой итоги хранятся в Counter.base.
+class CounterRegistry:
+    def __init__(self, before: Optional[date] = None):
+        self.before = before
+        self._counters: Dict[CounterKey, Counter] = {}
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+    def __iter__(self) -> Iterator[Counter]:
+        return iter(list(self._counters.values()))
+
+    def get(self, chat_id: int, thread_id: Optional[int]) -> Optional[Counter]:
+        if thread_id is None:
+            return None
+        return self._counters.get((chat_id, thread_id))
+
+    def in_chat(self, chat_id: int) -> List[Counter]:
+        return [counter for counter in self._counters.values() if counter.chat_id == chat_id]
+
+    def register(self, counter: Counter) -> Counter:
+        return self._counters.setdefault(counter.key, counter)
+
+    # Убирает счётчик, только если под его ключом зарегистрирован именно он
+    def unregister(self, counter: Counter) -> None:
+        if self._counters.get(counter.key) is counter:
+            del self._counters[counter.key]
+
+    def to_snapshot(self) -> dict:
+        return {
+            "version": 2,
+            "before": self.before.isoformat() if self.before else None,
+            "counters": [counter.to_dict() for counter in self._counters.values()],
+        }
+
+    @classmethod
+    def from_snapshot(cls, payload: dict) -> "CounterRegistry":
+        if payload.get("version") != 2:
+            raise ValueError(f"неподдерживаемая версия снимка: {payload.get('version')}")
+        before = date.fromisoformat(payload["before"]) if payload.get("before") else None
+        registry = cls(before)
+        for raw in payload.get("counters", []):
+            registry.register(Counter.from_dict(raw))
+        return registry
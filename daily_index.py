@@ -0,0 +1,128 @@
+import logging
+from array import array
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, thread_id) темы, в которой работает счётчик
+CounterKey = Tuple[int, int]
+
+
+def _zeros(days: int) -> array:
+    return array("q", bytes(8 * days))
+
+
+# Дневные итоги одного счётчика: для каждого участника массив int64 по дням, начиная с дня origin (ordinal)
+class CounterDays:
+    __slots__ = ("origin", "days", "users")
+
+    def __init__(self, origin: int, days: int = 0):
+        self.origin = origin
+        self.days = days
+        self.users: Dict[int, array] = {}
+
+    @property
+    def end(self) -> int:
+        return self.origin + self.days
+
+    # Расширяет массивы так, чтобы в них попадал день ordinal
+    def _cover(self, ordinal: int) -> None:
+        if ordinal < self.origin:
+            shift = self.origin - ordinal
+            for values in self.users.values():
+                values[0:0] = _zeros(shift)
+            self.origin = ordinal
+            self.days += shift
+        if ordinal >= self.end:
+            grow = ordinal - self.end + 1
+            for values in self.users.values():
+                values.extend(_zeros(grow))
+            self.days += grow
+
+    def add(self, user_id: int, ordinal: int, delta: int) -> None:
+        self._cover(ordinal)
+        values = self.users.get(user_id)
+        if values is None:
+            values = self.users[user_id] = _zeros(self.days)
+        values[ordinal - self.origin] += delta
+
+    def total(self, user_id: int) -> int:
+        values = self.users.get(user_id)
+        return sum(values) if values is not None else 0
+
+    # Значения за [start, end); дни вне известного диапазона – нули
+    def values(self, user_id: int, start: int, end: int) -> array:
+        if end <= start:
+            return array("q")
+        values = self.users.get(user_id)
+        lo, hi = max(start, self.origin), min(end, self.end)
+        if values is None or lo >= hi:
+            return _zeros(end - start)
+        return _zeros(lo - start) + values[lo - self.origin:hi - self.origin] + _zeros(end - hi)
+
+
+# Суммы по корзинам: day – по дням, week – по неделям с понедельника, month – по календарным месяцам.
+# Возвращает начала корзин (ordinal) и суммы для каждой.
+def rollup(values: array, start: int, granularity: str) -> Tuple[List[int], List[int]]:
+    if granularity == "day":
+        return list(range(start, start + len(values))), list(values)
+    bounds = []
+    for offset in range(len(values)):
+        day = date.fromordinal(start + offset)
+        if offset == 0 or (granularity == "week" and day.weekday() == 0) or (granularity == "month" and day.day == 1):
+            bounds.append(offset)
+    bounds.append(len(values))
+    return [start + lo for lo in bounds[:-1]], [sum(values[lo:hi]) for lo, hi in zip(bounds, bounds[1:])]
+
+
+# Текущая серия (дни подряд с ненулевым счётом, заканчивающиеся сегодня или вчера) и самая длинная серия
+def streaks(values: array) -> Tuple[int, int]:
+    longest = run = 0
+    for value in values:
+        run = run + 1 if value > 0 else 0
+        longest = max(longest, run)
+    current = 0
+    tail = len(values) - 1
+    if tail >= 0 and values[tail] <= 0:
+        tail -= 1
+    while tail >= 0 and values[tail] > 0:
+        current += 1
+        tail -= 1
+    return current, longest
+
+
+# Индекс дневных итогов по счётчикам. Строится из actions при первом обращении к счётчику,
+# дальше обновляется на месте вместе с Counter.add, поэтому статистика не ходит в БД.
+class DailyIndex:
+    def __init__(self):
+        self._counters: Dict[CounterKey, CounterDays] = {}
+
+    def get(self, key: CounterKey) -> Optional[CounterDays]:
+        return self._counters.get(key)
+
+    def drop(self, key: CounterKey) -> None:
+        self._counters.pop(key, None)
+
+    # Приращение для уже построенного индекса; пока индекса нет, его учтёт сверка при построении
+    def add(self, key: CounterKey, user_id: int, ordinal: int, delta: int) -> None:
+        days = self._counters.get(key)
+        if days is not None:
+            days.add(user_id, ordinal, delta)
+
+    # Добавляет строку actions в ещё не зарегистрированный индекс
+    @staticmethod
+    def add_row(days: CounterDays, row: dict) -> None:
+        days.add(row["user_id"], date.fromisoformat(row["date"]).toordinal(), row["count"])
+
+    # Сверяет индекс, собранный из строк actions, с итогами счётчика и регистрирует его: разница (записи журнала,
+    # ещё не перенесённые в БД, и приращения во время чтения) относится на today.
+    # Между сверкой и регистрацией нет await, поэтому приращения после неё попадают уже в индекс.
+    def register(self, key: CounterKey, days: CounterDays, totals: Dict[int, int], today: int) -> CounterDays:
+        for user_id, total in totals.items():
+            missing = total - days.total(user_id)
+            if missing:
+                days.add(user_id, today, missing)
+        self._counters[key] = days
+        logger.info(f"Индекс дней счётчика {key} построен: {days.days} дн., {len(days.users)} участник(ов)")
+        return days
@@ -0,0 +1,104 @@
+import csv
+import io
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import AsyncIterator, Callable, List, Mapping, Optional
+
+# Потоковая выгрузка actions: строки приходят из БД постранично и сразу кодируются в CSV или NDJSON,
+# поэтому в памяти не больше одной страницы независимо от размера истории.
+
+COLUMNS = ("id", "chat_id", "thread_id", "user_id", "date", "count", "updated_at")
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+
+@dataclass
+class ExportParams:
+    format: str = "csv"
+    start: Optional[date] = None
+    end: Optional[date] = None
+    user_ids: Optional[List[int]] = None
+    chat_id: Optional[int] = None
+    thread_id: Optional[int] = None
+    since: Optional[datetime] = None
+
+    # Аргументы ActionsStore.iter_export
+    def query(self) -> dict:
+        return {
+            "start": self.start,
+            "end": self.end,
+            "user_ids": self.user_ids,
+            "chat_id": self.chat_id,
+            "thread_id": self.thread_id,
+            "since": self.since,
+        }
+
+
+def _int(args: Mapping[str, str], name: str) -> Optional[int]:
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} должен быть числом")
+
+
+# Параметры запроса: format=csv|ndjson, start и end – даты YYYY-MM-DD включительно, user_id=1,2,
+# chat_id, thread_id, since – время ISO 8601 (строки, изменённые строго после него). Ошибки – ValueError.
+def parse_export_params(args: Mapping[str, str]) -> ExportParams:
+    params = ExportParams(format=args.get("format", "csv"))
+    if params.format not in CONTENT_TYPES:
+        raise ValueError("format должен быть csv или ndjson")
+    try:
+        if args.get("start"):
+            params.start = date.fromisoformat(args["start"])
+        if args.get("end"):
+            params.end = date.fromisoformat(args["end"]) + timedelta(days=1)
+    except ValueError:
+        raise ValueError("start и end должны быть датами YYYY-MM-DD")
+    if args.get("user_id"):
+        try:
+            params.user_ids = [int(item) for item in args["user_id"].split(",") if item.strip()]
+        except ValueError:
+            raise ValueError("user_id должен быть списком чисел через запятую")
+    params.chat_id = _int(args, "chat_id")
+    params.thread_id = _int(args, "thread_id")
+    if args.get("since"):
+        try:
+            since = datetime.fromisoformat(args["since"])
+        except ValueError:
+            raise ValueError("since должен быть временем ISO 8601")
+        params.since = since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+    return params
+
+
+# Кодирует строки блоками по chunk_rows; on_rows получает число строк в каждом отданном блоке
+async def encode_rows(rows: AsyncIterator[dict], fmt: str, chunk_rows: int = 1000,
+                      on_rows: Optional[Callable[[int], None]] = None) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n") if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(COLUMNS)
+    pending = 0
+    async for row in rows:
+        if writer is not None:
+            writer.writerow([row.get(column) for column in COLUMNS])
+        else:
+            buffer.write(json.dumps({column: row.get(column) for column in COLUMNS}, ensure_ascii=False))
+            buffer.write("\n")
+        pending += 1
+        if pending >= chunk_rows:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            if on_rows:
+                on_rows(pending)
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+    if pending and on_rows:
+        on_rows(pending)
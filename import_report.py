@@ -0,0 +1,83 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Отчёт о стоимости импорта: время, пиковая память и загруженные тяжёлые библиотеки.
+# Запуск: python import_report.py [--runs N] [--json]
+
+HEAVY_MODULES = ["pandas", "numpy", "matplotlib", "seaborn"]
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "heavy": sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+SCENARIOS = [
+    ("bot (вебхук и подсчёт)", "import bot"),
+    ("bot + аналитика при импорте (как раньше)",
+     "import bot\nimport pandas, numpy, matplotlib.pyplot, seaborn\nseaborn.set_style('darkgrid')"),
+    ("процесс-рендерер", "import renderer\nrenderer._init_worker()"),
+]
+
+def run_probe(code: str) -> dict:
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(code=code, heavy=HEAVY_MODULES)],
+        capture_output=True, text=True, check=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+# Самые дорогие прямые импорты по -X importtime (накопительное время, мс)
+def slowest_imports(code: str, top: int = 10) -> list:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Вложенность отмечена отступом по два пробела: берём прямые импорты проверяемого модуля
+        name = name[1:]
+        if name.startswith("  ") and not name.startswith("   "):
+            entries.append((name.strip(), int(cumulative_us) / 1000))
+    return sorted(entries, key=lambda item: item[1], reverse=True)[:top]
+
+def main() -> None:
+    runs = 3
+    if "--runs" in sys.argv:
+        runs = int(sys.argv[sys.argv.index("--runs") + 1])
+    report = []
+    for title, code in SCENARIOS:
+        samples = [run_probe(code) for _ in range(runs)]
+        report.append({
+            "scenario": title,
+            "seconds_median": statistics.median(s["seconds"] for s in samples),
+            "max_rss_mb": max(s["max_rss_kb"] for s in samples) / 1024,
+            "heavy_loaded": samples[-1]["heavy"],
+        })
+    if "--json" in sys.argv:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    for row in report:
+        heavy = ", ".join(row["heavy_loaded"]) or "нет"
+        print(f"{row['scenario']:<45} {row['seconds_median'] * 1000:8.0f} мс {row['max_rss_mb']:8.1f} МБ  тяжёлые модули: {heavy}")
+    base, eager = report[0], report[1]
+    print(f"\nЭкономия на процесс: {(eager['seconds_median'] - base['seconds_median']) * 1000:.0f} мс импорта, "
+          f"{eager['max_rss_mb'] - base['max_rss_mb']:.1f} МБ памяти")
+    print("\nСамые дорогие импорты bot:")
+    for name, ms in slowest_imports("import bot"):
+        print(f"  {name:<40} {ms:8.1f} мс")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, thread_id, user_id, дата в формате YYYY-MM-DD)
+DayKey = Tuple[int, int, int, str]
+
+SCHEMA = """
+create table if not exists entries (
+    id integer primary key autoincrement,
+    chat_id integer not null,
+    thread_id integer not null,
+    user_id integer not null,
+    date text not null,
+    delta integer not null,
+    batch_id integer
+);
+create index if not exists entries_batch_idx on entries (batch_id);
+create table if not exists batches (
+    id integer primary key autoincrement,
+    targets text not null
+);
+create table if not exists totals (
+    chat_id integer not null,
+    thread_id integer not null,
+    user_id integer not null,
+    count integer not null,
+    seq integer not null,
+    primary key (chat_id, thread_id, user_id)
+);
+create index if not exists totals_seq_idx on totals (seq);
+create table if not exists counters (
+    chat_id integer not null,
+    thread_id integer not null,
+    payload text not null,
+    seq integer not null,
+    primary key (chat_id, thread_id)
+);
+create table if not exists meta (
+    key text primary key,
+    value integer not null
+);
+"""
+
+
+# Локальный журнал упреждающей записи (SQLite, WAL) для приращений счётчиков.
+#
+# Приращение считается принятым, когда оно зафиксировано в журнале. Коммит групповой: пока идёт fsync
+# одной пачки, новые записи копятся и уходят следующей транзакцией (commit_interval добавляет
+# к этому окну задержку). Фоновый проигрыватель переносит записи в actions пачками не больше batch_size записей:
+#   1. суммирует ещё не отправленные записи по ключу и читает текущие значения из БД;
+#   2. в одной транзакции журнала сохраняет пачку с абсолютными целевыми значениями и привязывает к ней записи;
+#   3. делает upsert целевых значений в actions;
+#   4. удаляет пачку и её записи из журнала.
+# Если процесс упал после шага 2, пачка повторяется с теми же абсолютными значениями, поэтому повтор идемпотентен.
+# Рассчитано на единственного писателя в actions: в режиме нескольких воркеров журнал переносит только владелец.
+#
+# С shared=True в том же файле ведётся общее состояние воркеров: итоги счётчиков (totals) обновляются
+# в транзакции вместе с записью журнала, настройки счётчиков лежат в counters. Каждое изменение получает
+# номер seq, по которому воркеры забирают чужие изменения.
+class Journal:
+    def __init__(self, path: str, commit_interval: float = 0.0, flush_interval: float = 2.0,
+                 flush_threshold: int = 50, max_backoff: float = 60.0, batch_size: int = 500):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        # Все операции с SQLite идут через один поток, поэтому соединение используется последовательно
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._buffer: List[tuple] = []
+        self._commit_task: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+        self._replay_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        # Ключи, появившиеся после последнего переноса: по их числу срабатывает порог flush_threshold
+        self._dirty = set()
+        self.shared = False
+        self.pending = 0
+        self.failures = 0
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # ------------- Операции SQLite (поток журнала) -------------
+
+    def _open_sync(self) -> int:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("pragma journal_mode=wal")
+        conn.execute("pragma synchronous=full")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+        return self._count_sync()
+
+    def _count_sync(self) -> int:
+        return self._conn.execute("select count(*) from entries").fetchone()[0]
+
+    def _max_id_sync(self) -> int:
+        return self._conn.execute("select coalesce(max(id), 0) from entries").fetchone()[0]
+
+    def _next_seq_sync(self) -> int:
+        self._conn.execute("insert into meta (key, value) values ('seq', 1) on conflict (key) do update set value = value + 1")
+        return self._conn.execute("select value from meta where key = 'seq'").fetchone()[0]
+
+    def _append_sync(self, rows: List[tuple]) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "insert into entries (chat_id, thread_id, user_id, date, delta) values (?, ?, ?, ?, ?)", rows
+            )
+            if self.shared:
+                seq = self._next_seq_sync()
+                self._conn.executemany(
+                    "insert into totals (chat_id, thread_id, user_id, count, seq) values (?, ?, ?, ?, ?) "
+                    "on conflict (chat_id, thread_id, user_id) do update set count = count + excluded.count, seq = excluded.seq",
+                    [(chat_id, thread_id, user_id, delta, seq) for chat_id, thread_id, user_id, _, delta in rows],
+                )
+
+    # counters: [(payload счётчика, {user_id: итог})]. reset – начать общее состояние заново (запуск владельца),
+    # иначе итоги уже известных пользователей не перезаписываются, чтобы не потерять чужие приращения.
+    def _publish_sync(self, counters: List[tuple], reset: bool) -> None:
+        with self._conn:
+            if reset:
+                self._conn.execute("delete from counters")
+                self._conn.execute("delete from totals")
+                self._conn.execute("delete from meta where key = 'ready'")
+            seq = self._next_seq_sync()
+            for payload, counts in counters:
+                self._conn.execute(
+                    "insert into counters (chat_id, thread_id, payload, seq) values (?, ?, ?, ?) "
+                    "on conflict (chat_id, thread_id) do update set payload = excluded.payload, seq = excluded.seq",
+                    (payload["chat_id"], payload["thread_id"], json.dumps(payload, ensure_ascii=False), seq),
+                )
+                self._conn.executemany(
+                    "insert into totals (chat_id, thread_id, user_id, count, seq) values (?, ?, ?, ?, ?) "
+                    "on conflict (chat_id, thread_id, user_id) do nothing",
+                    [(payload["chat_id"], payload["thread_id"], user_id, count, seq) for user_id, count in counts.items()],
+                )
+
+    # Изменения после номера since: (последний номер, payload счётчиков, строки итогов)
+    def _changes_sync(self, since: int):
+        row = self._conn.execute("select value from meta where key = 'seq'").fetchone()
+        seq = row[0] if row else 0
+        payloads = [json.loads(payload) for (payload,) in self._conn.execute(
+            "select payload from counters where seq > ?", (since,))]
+        totals = self._conn.execute(
+            "select chat_id, thread_id, user_id, count from totals where seq > ?", (since,)).fetchall()
+        return seq, payloads, totals
+
+    def _mark_ready_sync(self, generation: int, before: int) -> None:
+        with self._conn:
+            self._conn.execute("insert or replace into meta (key, value) values ('before', ?)", (before,))
+            self._conn.execute("insert or replace into meta (key, value) values ('ready', ?)", (generation,))
+
+    def _ready_sync(self, generation: int) -> Optional[int]:
+        rows = dict(self._conn.execute("select key, value from meta where key in ('ready', 'before')"))
+        return rows.get("before") if rows.get("ready") == generation else None
+
+    # Незавершённая пачка после сбоя или суммы первых batch_size новых записей с id не больше upto
+    # (с максимальным id, вошедшим в сумму); последний элемент – могут ли за пачкой остаться записи
+    def _claim_sync(self, upto: int):
+        row = self._conn.execute("select id, targets from batches order by id limit 1").fetchone()
+        if row is not None:
+            targets = {tuple(item[:4]): item[4] for item in json.loads(row[1])}
+            return row[0], targets, None, True
+        max_id, claimed = self._conn.execute(
+            "select max(id), count(*) from (select id from entries where batch_id is null and id <= ? order by id limit ?)",
+            (upto, self.batch_size),
+        ).fetchone()
+        if max_id is None:
+            return None, {}, None, False
+        deltas = {
+            (chat_id, thread_id, user_id, day): delta
+            for chat_id, thread_id, user_id, day, delta in self._conn.execute(
+                "select chat_id, thread_id, user_id, date, sum(delta) from entries "
+                "where batch_id is null and id <= ? group by chat_id, thread_id, user_id, date",
+                (max_id,),
+            )
+        }
+        return None, deltas, max_id, claimed >= self.batch_size
+
+    def _prepare_sync(self, targets: Dict[DayKey, int], max_id: int) -> int:
+        with self._conn:
+            cursor = self._conn.execute(
+                "insert into batches (targets) values (?)",
+                (json.dumps([[*key, count] for key, count in targets.items()]),),
+            )
+            batch_id = cursor.lastrowid
+            self._conn.execute(
+                "update entries set batch_id = ? where batch_id is null and id <= ?", (batch_id, max_id)
+            )
+        return batch_id
+
+    def _applied_sync(self, batch_id: int) -> int:
+        with self._conn:
+            removed = self._conn.execute("delete from entries where batch_id = ?", (batch_id,)).rowcount
+            self._conn.execute("delete from batches where id = ?", (batch_id,))
+        return removed
+
+    # Сжатие: после удаления применённых записей WAL-файл обрезается до нуля
+    def _compact_sync(self) -> None:
+        self._conn.execute("pragma wal_checkpoint(truncate)")
+
+    def _pending_deltas_sync(self) -> Dict[DayKey, int]:
+        return {
+            (chat_id, thread_id, user_id, day): delta
+            for chat_id, thread_id, user_id, day, delta in self._conn.execute(
+                "select chat_id, thread_id, user_id, date, sum(delta) from entries "
+                "group by chat_id, thread_id, user_id, date"
+            )
+        }
+
+    def _close_sync(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ------------- Сторона event loop -------------
+
+    async def open(self) -> None:
+        self.pending = await self._run(self._open_sync)
+        logger.info(f"Журнал счётчиков {self.path} открыт, неотправленных записей: {self.pending}")
+
+    # Ждёт фиксации приращения в журнале; запись в actions выполнит проигрыватель
+    async def append(self, key: DayKey, delta: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((*key, delta, future))
+        if self._commit_task is None:
+            self._commit_task = asyncio.create_task(self._commit_soon())
+        await future
+
+    # Одна задача коммитит всё накопленное, пока буфер не опустеет
+    async def _commit_soon(self) -> None:
+        try:
+            while self._buffer:
+                if self.commit_interval:
+                    await asyncio.sleep(self.commit_interval)
+                batch, self._buffer = self._buffer, []
+                try:
+                    await self._run(self._append_sync, [item[:5] for item in batch])
+                except Exception as e:
+                    logger.error("Не удалось записать %s приращений в журнал: %s", len(batch), e)
+                    for item in batch:
+                        if not item[5].done():
+                            item[5].set_exception(e)
+                    continue
+                self.pending += len(batch)
+                self._dirty.update(item[:4] for item in batch)
+                for item in batch:
+                    if not item[5].done():
+                        item[5].set_result(None)
+                if len(self._dirty) >= self.flush_threshold:
+                    self._wakeup.set()
+        finally:
+            self._commit_task = None
+
+    async def publish(self, counters: List[tuple], reset: bool = False) -> None:
+        await self._run(self._publish_sync, counters, reset)
+
+    async def changes(self, since: int):
+        return await self._run(self._changes_sync, since)
+
+    # Владелец отмечает, что общее состояние этого запуска (generation) готово; before – ordinal границы снимка
+    async def mark_ready(self, generation: int, before: int) -> None:
+        await self._run(self._mark_ready_sync, generation, before)
+
+    # Остальные воркеры ждут готовности и получают границу снимка
+    async def wait_ready(self, generation: int, poll: float = 0.1) -> int:
+        while True:
+            before = await self._run(self._ready_sync, generation)
+            if before is not None:
+                return before
+            await asyncio.sleep(poll)
+
+    # Суммы по ключам для записей, ещё не подтверждённых в actions
+    async def pending_deltas(self) -> Dict[DayKey, int]:
+        return await self._run(self._pending_deltas_sync)
+
+    # Одна пачка из записей с id не больше upto: возвращает True, если за ней могут остаться записи
+    async def replay_once(self, store, upto: int = (1 << 63) - 1) -> bool:
+        async with self._replay_lock:
+            batch_id, values, max_id, more = await self._run(self._claim_sync, upto)
+            if not values:
+                return False
+            if batch_id is None:
+                self._dirty.clear()
+                current = await store.fetch_counts(list(values))
+                targets = {key: current.get(key, 0) + delta for key, delta in values.items()}
+                batch_id = await self._run(self._prepare_sync, targets, max_id)
+            else:
+                logger.warning(f"Повтор незавершённой пачки журнала {batch_id}")
+                targets = values
+            await store.upsert_counts(targets)
+            applied = await self._run(self._applied_sync, batch_id)
+            self.pending = max(0, self.pending - applied)
+            logger.info("Журнал: в actions применено %s записей (%s ключей)", applied, len(targets))
+            return more
+
+    # Переносит всё, что было в журнале на момент вызова; записи, пришедшие во время переноса, ждут следующего
+    async def flush(self, store) -> bool:
+        try:
+            upto = await self._run(self._max_id_sync)
+            while await self.replay_once(store, upto):
+                pass
+            await self._run(self._compact_sync)
+            # Записи других воркеров в общем журнале видны только через сам файл
+            self.pending = await self._run(self._count_sync)
+            self.failures = 0
+            return True
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Ошибка переноса журнала в Supabase (попытка {self.failures}): {str(e)}")
+            return False
+
+    def start(self, store) -> None:
+        if self._replay_task is None:
+            self._replay_task = asyncio.create_task(self._replay_loop(store))
+            logger.info(f"Проигрыватель журнала запущен (интервал {self.flush_interval} с, порог {self.flush_threshold} записей)")
+
+    async def _replay_loop(self, store) -> None:
+        while True:
+            if self.failures:
+                # После ошибок ждём с экспоненциальной задержкой, не реагируя на порог
+                await asyncio.sleep(min(self.flush_interval * 2 ** self.failures, self.max_backoff))
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            if self.pending or self.shared:
+                await self.flush(store)
+            # Порог, сработавший во время переноса, относится к уже перенесённым ключам
+            self._wakeup.clear()
+
+    # store=None – без переноса: журнал этого воркера переносит владелец
+    async def stop(self, store=None) -> None:
+        if self._replay_task is not None:
+            self._replay_task.cancel()
+            try:
+                await self._replay_task
+            except asyncio.CancelledError:
+                pass
+            self._replay_task = None
+        if self._commit_task is not None:
+            await self._commit_task
+        if store is not None and not await self.flush(store):
+            logger.warning(f"{self.pending} записей останутся в журнале и будут отправлены при следующем запуске")
+        await self._run(self._close_sync)
+        self._executor.shutdown(wait=True)
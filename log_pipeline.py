@@ -0,0 +1,125 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import Dict, Optional
+
+# Неблокирующее логирование: обработчики только кладут LogRecord в очередь,
+# а форматирование и запись в stdout выполняет отдельный поток QueueListener.
+# Поля chat/thread_id/user/update_id берутся из контекста текущего обновления,
+# частые события (extra={"event": ...}) можно прореживать через LOG_SAMPLE.
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+FIELDS = ("event", "chat", "thread_id", "user", "update_id", "duration_ms", "sampled")
+
+# Контекст обновления, которое сейчас обрабатывается в этой задаче
+log_context: contextvars.ContextVar[Dict[str, object]] = contextvars.ContextVar("log_context", default={})
+
+
+# "webhook=100,counted=20" – писать каждое 100-е событие webhook и каждое 20-е counted
+def parse_sampling(spec: str) -> Dict[str, int]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, every = item.partition("=")
+        rates[event.strip()] = max(1, int(every))
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: Dict[str, int]):
+        super().__init__()
+        self.rates = rates
+        self._seen: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Предупреждения и ошибки пишутся всегда и целиком
+        if record.levelno >= logging.WARNING:
+            return True
+        event = getattr(record, "event", None)
+        every = self.rates.get(event)
+        if not every or every == 1:
+            return True
+        seen = self._seen.get(event, 0)
+        self._seen[event] = seen + 1
+        if seen % every:
+            return False
+        record.sampled = every
+        return True
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+# Не форматирует запись в вызывающем потоке: сообщение собирается уже в потоке слушателя
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# Повторная остановка (явная и из atexit) ничего не делает
+class SafeQueueListener(logging.handlers.QueueListener):
+    def stop(self) -> None:
+        if self._thread is not None:
+            super().stop()
+
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, json_output: bool = False):
+        super().__init__(TEXT_FORMAT)
+        self.json_output = json_output
+
+    @staticmethod
+    def _fields(record: logging.LogRecord) -> Dict[str, object]:
+        return {key: getattr(record, key) for key in FIELDS if getattr(record, key, None) is not None}
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        fields = self._fields(record)
+        if fields:
+            line += " | " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not self.json_output:
+            return super().format(record)
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **self._fields(record),
+        }
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def setup_logging(level: Optional[str] = None, log_format: Optional[str] = None,
+                  sampling: Optional[str] = None) -> SafeQueueListener:
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    log_format = log_format or os.getenv("LOG_FORMAT", "text")
+    sampling = sampling if sampling is not None else os.getenv("LOG_SAMPLE", "webhook=100,counted=20,update_done=100,edit=10")
+
+    stream_handler = logging.StreamHandler(sys.stdout if log_format == "json" else None)
+    stream_handler.setFormatter(StructuredFormatter(json_output=log_format == "json"))
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sampling(sampling)))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    listener = SafeQueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,226 @@
+import bisect
+import functools
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Минимальные метрики в формате Prometheus без внешних зависимостей.
+# Дочерние метрики с зафиксированными метками создаются заранее через labels(),
+# поэтому на горячем пути остаются только perf_counter, bisect и сложение.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    @contextmanager
+    def track_inprogress(self):
+        self.value += 1
+        try:
+            yield
+        finally:
+            self.value -= 1
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {child.value}" for key, child in self._children.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+    def track_inprogress(self):
+        return self._default.track_inprogress()
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+# Метрика, значение которой читается в момент выгрузки (глубина очереди, размер буфера и т.п.)
+class CallbackMetric(_Metric):
+    def __init__(self, name: str, documentation: str, kind: str, fn: Callable[[], float]):
+        self.kind = kind
+        self._fn = fn
+        super().__init__(name, documentation)
+
+    def _new_child(self):
+        return None
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {float(self._fn())}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def callback(self, name: str, documentation: str, kind: str, fn: Callable[[], float]) -> None:
+        self.register(CallbackMetric(name, documentation, kind, fn))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# Декоратор замера длительности корутины в уже выбранную дочернюю гистограмму
+def timed(child: _HistogramChild):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# ------------- Метрики бота -------------
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    "bot_handler_duration_seconds", "Длительность обработчиков команд и сообщений", ["handler"]))
+SUPABASE_LATENCY = REGISTRY.register(Histogram(
+    "supabase_request_duration_seconds", "Длительность запросов к Supabase", ["operation", "outcome"]))
+SUPABASE_IN_FLIGHT = REGISTRY.register(Gauge(
+    "supabase_requests_in_flight", "Запросы к Supabase в процессе выполнения"))
+EDIT_LATENCY = REGISTRY.register(Histogram(
+    "telegram_edit_duration_seconds", "Длительность попыток правки сообщения-счётчика", ["outcome"]))
+RENDER_LATENCY = REGISTRY.register(Histogram(
+    "chart_render_duration_seconds", "Длительность рендера графика", ["outcome"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 60.0)))
+RENDER_IN_FLIGHT = REGISTRY.register(Gauge(
+    "chart_renders_in_flight", "Графики в процессе рендера"))
+OUTBOUND_WAIT = REGISTRY.register(Histogram(
+    "telegram_outbound_wait_seconds", "Ожидание исходящего вызова в очереди планировщика", ["lane"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)))
+OUTBOUND_SENT = REGISTRY.register(Counter(
+    "telegram_outbound_calls_total", "Завершённые исходящие вызовы Bot API", ["lane", "outcome"]))
+OUTBOUND_RETRIES = REGISTRY.register(Counter(
+    "telegram_outbound_retries_total", "Повторы исходящих вызовов", ["lane", "reason"]))
+OUTBOUND_SHED = REGISTRY.register(Counter(
+    "telegram_outbound_shed_total", "Исходящие вызовы, отклонённые планировщиком", ["lane", "reason"]))
+EXPORT_ROWS = REGISTRY.register(Counter(
+    "export_rows_total", "Строки actions, отданные через /export", ["format"]))
@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from metrics import OUTBOUND_RETRIES, OUTBOUND_SENT, OUTBOUND_SHED, OUTBOUND_WAIT
+
+logger = logging.getLogger(__name__)
+
+SendFactory = Callable[[], Awaitable[Any]]
+
+# Полосы в порядке приоритета: правки счётчиков, ответы на команды, графики
+EDIT = "edit"
+REPLY = "reply"
+CHART = "chart"
+LANES = (EDIT, REPLY, CHART)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+# Вызов не отправлен: очередь полосы переполнена или вызов прождал дольше допустимого
+class OutboundShed(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Через сколько секунд будет доступен токен (0 – доступен сейчас)
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass(eq=False)
+class _Job:
+    lane: str
+    chat_id: int
+    send: SendFactory
+    future: asyncio.Future
+    enqueued: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+# Единая точка исходящих вызовов Bot API. Вызовы ждут в полосах по приоритету и уходят, когда есть токен
+# в общем ведре (лимит бота) и в ведре чата (лимит группы). RetryAfter блокирует чат на указанное Telegram время,
+# после чего вызов повторяется; сетевые ошибки повторяются с экспоненциальной задержкой.
+# Правки склеиваются, поэтому уступают: ответ или график, прождавший дольше yield_after, получает следующий токен
+# своего чата раньше правок. Переполнение полосы и слишком долгое ожидание отклоняют вызов с OutboundShed.
+class OutboundScheduler:
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 20 / 60, chat_burst: float = 3,
+                 max_in_flight: int = 8, lane_limits: Optional[Dict[str, int]] = None,
+                 max_wait: Optional[Dict[str, float]] = None, max_attempts: int = 5, max_chats: int = 10000,
+                 yield_after: float = 2.0):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.max_chats = max_chats
+        self.yield_after = yield_after
+        self.lane_limits = {EDIT: 500, REPLY: 200, CHART: 50, **(lane_limits or {})}
+        self.max_wait = {EDIT: 120.0, REPLY: 60.0, CHART: 60.0, **(max_wait or {})}
+        self._lanes: Dict[str, Deque[_Job]] = {lane: deque() for lane in LANES}
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._blocked_until: Dict[int, float] = {}
+        self._slots = asyncio.Semaphore(max(1, max_in_flight))
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sending: set = set()
+
+    def depth(self, lane: str) -> int:
+        return len(self._lanes[lane])
+
+    # Ставит вызов в полосу и ждёт его результата
+    async def submit(self, lane: str, chat_id: int, send: SendFactory) -> Any:
+        queue = self._lanes[lane]
+        if len(queue) >= self.lane_limits[lane]:
+            OUTBOUND_SHED.labels(lane=lane, reason="queue_full").inc()
+            logger.warning(f"Полоса {lane} переполнена ({len(queue)}), вызов для чата {chat_id} отклонён")
+            raise OutboundShed(f"полоса {lane} переполнена")
+        job = _Job(lane, chat_id, send, asyncio.get_running_loop().create_future())
+        queue.append(job)
+        self._wakeup.set()
+        return await job.future
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch())
+            logger.info(f"Планировщик исходящих вызовов запущен: {self.global_rate}/с всего, {self.chat_rate:.2f}/с на чат")
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                # Полные вёдра ничем не отличаются от новых, их можно забыть
+                for idle in [key for key, value in self._chats.items() if value.full(now)]:
+                    del self._chats[idle]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _shed(self, job: _Job, reason: str) -> None:
+        OUTBOUND_SHED.labels(lane=job.lane, reason=reason).inc()
+        if not job.future.done():
+            job.future.set_exception(OutboundShed(f"вызов в полосе {job.lane} отклонён: {reason}"))
+
+    # Первый готовый к отправке вызов по приоритету полос; иначе – через сколько секунд проверить снова
+    def _next_job(self) -> Tuple[Optional[_Job], Optional[float]]:
+        now = time.monotonic()
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0:
+            return None, global_wait
+        soonest: Optional[float] = None
+        # Чаты, где ответ или график ждёт дольше yield_after: их правки пропускают ход
+        overdue = {job.chat_id for lane in (REPLY, CHART) for job in self._lanes[lane]
+                   if now - job.enqueued > self.yield_after}
+        for lane in LANES:
+            queue = self._lanes[lane]
+            for job in list(queue):
+                if job.future.done():
+                    queue.remove(job)
+                    continue
+                if now - job.enqueued > self.max_wait[lane]:
+                    queue.remove(job)
+                    logger.warning(f"Вызов для чата {job.chat_id} в полосе {lane} ждал дольше {self.max_wait[lane]} с и отклонён")
+                    self._shed(job, "timeout")
+                    continue
+                if lane == EDIT and job.chat_id in overdue:
+                    continue
+                bucket = self._chat_bucket(job.chat_id, now)
+                wait = max(self._blocked_until.get(job.chat_id, 0.0) - now, bucket.wait_time(now))
+                if wait <= 0:
+                    queue.remove(job)
+                    bucket.take(now)
+                    self._global.take(now)
+                    return job, None
+                soonest = wait if soonest is None else min(soonest, wait)
+        return None, soonest
+
+    async def _dispatch(self) -> None:
+        while True:
+            job, wait = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._slots.acquire()
+            task = asyncio.create_task(self._send(job))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    def _retry(self, job: _Job, error: Exception, reason: str, delay: float) -> None:
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            OUTBOUND_SENT.labels(lane=job.lane, outcome="error").inc()
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        OUTBOUND_RETRIES.labels(lane=job.lane, reason=reason).inc()
+        self._blocked_until[job.chat_id] = max(self._blocked_until.get(job.chat_id, 0.0), time.monotonic() + delay)
+        # Повтор идёт первым в своей полосе, чтобы не менять порядок вызовов чата
+        self._lanes[job.lane].appendleft(job)
+
+    async def _send(self, job: _Job) -> None:
+        try:
+            if job.future.done():
+                return
+            if not job.attempts:
+                OUTBOUND_WAIT.labels(lane=job.lane).observe(time.monotonic() - job.enqueued)
+            try:
+                result = await job.send()
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                logger.warning(f"Telegram просит подождать {delay} с перед вызовом в чате {job.chat_id}")
+                self._retry(job, e, "retry_after", delay)
+            except BadRequest as e:
+                OUTBOUND_SENT.labels(lane=job.lane, outcome="error").inc()
+                if not job.future.done():
+                    job.future.set_exception(e)
+            except NetworkError as e:
+                logger.warning(f"Сетевая ошибка при вызове в чате {job.chat_id}: {str(e)}")
+                self._retry(job, e, "network", min(2 ** job.attempts, 30))
+            except Exception as e:
+                OUTBOUND_SENT.labels(lane=job.lane, outcome="error").inc()
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                OUTBOUND_SENT.labels(lane=job.lane, outcome="ok").inc()
+                if not job.future.done():
+                    job.future.set_result(result)
+        finally:
+            self._slots.release()
+            self._wakeup.set()
+
+    # Отклоняет всё, что не успело уйти, и ждёт уже начатые вызовы
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.gather(*self._sending, return_exceptions=True)
+        for queue in self._lanes.values():
+            while queue:
+                self._shed(queue.popleft(), "shutdown")
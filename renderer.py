@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import List, Optional, Sequence, Tuple
+
+from log_pipeline import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# (подпись, цвет столбцов, цвет тренда, значения по корзинам графика; подписи корзин передаются отдельно)
+Series = Tuple[str, str, str, Sequence[int]]
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "1"))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "20"))
+RENDER_MAX_CONCURRENCY = int(os.getenv("RENDER_MAX_CONCURRENCY", str(RENDER_WORKERS)))
+# 0 – не поднимать процессы при запуске, а создать пул при первом /stats_counter
+RENDER_PRESTART = os.getenv("RENDER_PRESTART", "1") == "1"
+
+# ------------- Код, выполняемый в процессах-рендерерах -------------
+# matplotlib/seaborn импортируются только здесь, в процессах пула: процесс вебхука их никогда не загружает.
+
+_plt = None
+
+# Инициализация процесса: бэкенд Agg, стиль seaborn и прогрев шрифтов — один раз на процесс, а не на каждый график
+def _init_worker() -> None:
+    global _plt
+    # Обработчик очереди логов унаследован от родителя без потока-слушателя: без своего конвейера записи терялись бы
+    setup_logging()
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set_style('darkgrid')
+    fig, ax = plt.subplots(figsize=(2, 2))
+    ax.set_title("Аналитика действий", fontsize=16)
+    ax.text(0.5, 0.5, "0123456789", fontsize=14)
+    fig.canvas.draw()
+    plt.close(fig)
+    _plt = plt
+
+def _warmup() -> int:
+    return os.getpid()
+
+def _rolling_mean(values: Sequence[int], window: int) -> List[float]:
+    result = []
+    for i in range(len(values)):
+        if i + 1 < window:
+            result.append(math.nan)
+        else:
+            result.append(sum(values[i + 1 - window:i + 1]) / window)
+    return result
+
+def _set_labels(ax) -> None:
+    ax.set_title("Аналитика действий", fontsize=16)
+    ax.set_xlabel("Дата", fontsize=14)
+    ax.set_ylabel("Количество действий", fontsize=14)
+
+def render_stats_png(series: List[Series], labels: List[str]) -> bytes:
+    plt = _plt
+    fig, ax = plt.subplots(figsize=(12, 6))
+    try:
+        days = len(series[0][3]) if series else 0
+        if days == 0:
+            ax.text(0.5, 0.5, 'Нет данных за выбранный период', ha='center', va='center', fontsize=14)
+            _set_labels(ax)
+        else:
+            x = list(range(days))
+            bar_width = 0.35
+            for i, (label, color, _, values) in enumerate(series):
+                offset = (i - (len(series) - 1) / 2) * bar_width
+                ax.bar([xi + offset for xi in x], values, bar_width, label=label, color=color, alpha=0.7)
+            if days >= 3:
+                for label, _, trend_color, values in series:
+                    ax.plot(x, _rolling_mean(values, 3), color=trend_color, linestyle='--', label=f'Тренд {label}')
+            ax.set_xticks(x)
+            ax.set_xticklabels(labels, rotation=45)
+            _set_labels(ax)
+            ax.legend()
+            ax.grid(True, linestyle='--', alpha=0.7)
+            fig.autofmt_xdate()
+        buf = BytesIO()
+        fig.tight_layout()
+        fig.savefig(buf, format='png', bbox_inches='tight', dpi=120)
+        return buf.getvalue()
+    except Exception as e:
+        # Ошибка уходит вызывающему: картинка-заглушка попала бы в кеш графиков под текущей версией данных
+        logger.error(f"Ошибка генерации графика: {str(e)}")
+        raise
+    finally:
+        plt.close(fig)
+
+# ------------- Сторона event loop -------------
+
+# Рендерер графиков на пуле процессов: event loop только ждёт готовый PNG.
+# Семафор ограничивает число одновременных рендеров, остальные запросы ждут своей очереди.
+class ChartRenderer:
+    def __init__(self, workers: int = RENDER_WORKERS, timeout: float = RENDER_TIMEOUT,
+                 max_concurrency: int = RENDER_MAX_CONCURRENCY):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _create_pool(self) -> ProcessPoolExecutor:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker)
+
+    # Поднимает процессы заранее, чтобы первый /stats_counter не платил за импорт matplotlib
+    def start(self) -> None:
+        if self._pool is None:
+            self._pool = self._create_pool()
+            for _ in range(self.workers):
+                self._pool.submit(_warmup)
+            logger.info(f"Пул рендеринга запущен: {self.workers} процесс(ов)")
+
+    def _reset_pool(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        # Зависший рендер нельзя отменить через future, поэтому процессы пула завершаются принудительно
+        processes = list(getattr(pool, "_processes", {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.terminate()
+        logger.warning("Пул рендеринга перезапущен")
+
+    async def render(self, series: List[Series], labels: List[str]) -> bytes:
+        async with self._semaphore:
+            if self._pool is None:
+                self.start()
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._pool, render_stats_png, series, labels)
+            try:
+                return await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Рендер графика не уложился в {self.timeout} с")
+                self._reset_pool()
+                raise
+            except BrokenProcessPool:
+                self._reset_pool()
+                raise
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
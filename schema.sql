@@ -0,0 +1,31 @@
+-- Таблица дневных счётчиков в Supabase.
+-- Строка – сумма сообщений участника за день в одном счётчике (теме супергруппы chat_id/thread_id).
+-- Уникальный ключ нужен для пакетного upsert из буфера отложенной записи.
+create table if not exists actions (
+    id bigint generated by default as identity primary key,
+    chat_id bigint not null default 0,
+    thread_id bigint not null default 0,
+    user_id bigint not null,
+    date date not null,
+    count integer not null default 0,
+    -- Время последней записи строки; выставляет писатель при upsert, по нему работает курсор since выгрузки
+    updated_at timestamptz not null default now(),
+    unique (chat_id, thread_id, user_id, date)
+);
+
+-- Выборки статистики фильтруют по диапазону дат и сортируют по дате
+create index if not exists actions_date_idx on actions (date, user_id);
+create index if not exists actions_counter_date_idx on actions (chat_id, thread_id, date);
+-- Инкрементальная выгрузка читает строки по (updated_at, id)
+create index if not exists actions_updated_idx on actions (updated_at, id);
+
+-- Миграция с версии на одну тему (actions без chat_id/thread_id):
+-- alter table actions add column chat_id bigint not null default 0,
+--                     add column thread_id bigint not null default 0;
+-- update actions set chat_id = <id супергруппы>, thread_id = <id темы> where chat_id = 0;
+-- alter table actions drop constraint actions_user_id_date_key,
+--                     add constraint actions_chat_thread_user_date_key unique (chat_id, thread_id, user_id, date);
+
+-- Миграция: колонка updated_at для инкрементальной выгрузки
+-- alter table actions add column if not exists updated_at timestamptz not null default now();
+-- create index if not exists actions_updated_idx on actions (updated_at, id);
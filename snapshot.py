@@ -0,0 +1,28 @@
+import json
+import logging
+import os
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Снимок реестра счётчиков: настройки каждого счётчика и итоги участников за дни строго до даты before.
+# Прошедшие дни в actions больше не меняются, поэтому при старте достаточно догрузить строки с date >= before.
+def load_snapshot(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.info(f"Снимок счётчиков {path} не найден")
+    except Exception as e:
+        logger.warning(f"Снимок счётчиков {path} повреждён и будет проигнорирован: {str(e)}")
+    return None
+
+# Атомарная запись: сначала во временный файл, затем rename поверх старого снимка
+def save_snapshot(path: str, payload: dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
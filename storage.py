@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import time
+from datetime import date, datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+
+import httpx
+from supabase import AsyncClient, acreate_client
+from supabase.lib.client_options import AsyncClientOptions
+
+from metrics import SUPABASE_IN_FLIGHT, SUPABASE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, thread_id, user_id, дата в формате YYYY-MM-DD)
+DayKey = Tuple[int, int, int, str]
+# (chat_id, thread_id, user_id)
+UserKey = Tuple[int, int, int]
+
+
+# Асинхронный доступ к таблице actions поверх AsyncClient Supabase.
+# Все запросы идут через один httpx-пул с keep-alive соединениями, ограничены по времени
+# и по числу одновременных вызовов, поэтому обработчики не блокируют event loop и не перегружают БД.
+class ActionsStore:
+    def __init__(self, url: str, key: str, timeout: float = 10.0, max_concurrency: int = 8,
+                 max_connections: int = 10, page_size: int = 1000):
+        self._url = url
+        self._key = key
+        self.timeout = timeout
+        self.page_size = page_size
+        self._max_connections = max_connections
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._http: Optional[httpx.AsyncClient] = None
+        self._client: Optional[AsyncClient] = None
+
+    async def connect(self) -> None:
+        self._http = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self._max_connections,
+                max_keepalive_connections=self._max_connections,
+                keepalive_expiry=60,
+            ),
+        )
+        self._client = await acreate_client(
+            self._url,
+            self._key,
+            options=AsyncClientOptions(httpx_client=self._http, postgrest_client_timeout=self.timeout),
+        )
+
+    async def close(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    def _table(self):
+        return self._client.table("actions")
+
+    async def _execute(self, operation: str, query) -> list:
+        async with self._semaphore:
+            started = time.perf_counter()
+            outcome = "ok"
+            try:
+                with SUPABASE_IN_FLIGHT.track_inprogress():
+                    response = await asyncio.wait_for(query.execute(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                raise
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                SUPABASE_LATENCY.labels(operation=operation, outcome=outcome).observe(time.perf_counter() - started)
+        return response.data
+
+    # Текущие значения count по ключам; отсутствующих строк в ответе нет. Ответ читается постранично до пустой
+    # страницы: PostgREST молча обрезает выборку по max-rows, а пропущенный ключ считался бы нулём.
+    async def fetch_counts(self, keys: Iterable[DayKey]) -> Dict[DayKey, int]:
+        keys = set(keys)
+        if not keys:
+            return {}
+        current: Dict[DayKey, int] = {}
+        offset = 0
+        while True:
+            page = await self._execute(
+                "increment_select",
+                self._table()
+                .select("chat_id, thread_id, user_id, date, count")
+                .in_("chat_id", sorted({key[0] for key in keys}))
+                .in_("thread_id", sorted({key[1] for key in keys}))
+                .in_("user_id", sorted({key[2] for key in keys}))
+                .in_("date", sorted({key[3] for key in keys}))
+                .order("date").order("chat_id").order("thread_id").order("user_id")
+                .range(offset, offset + self.page_size - 1)
+            )
+            if not page:
+                return current
+            for row in page:
+                key = (row["chat_id"], row["thread_id"], row["user_id"], row["date"])
+                if key in keys:
+                    current[key] = row["count"]
+            offset += len(page)
+
+    # Записывает абсолютные значения одним bulk upsert; повтор с теми же значениями ничего не меняет.
+    # updated_at отмечает строку для инкрементальной выгрузки.
+    async def upsert_counts(self, targets: Dict[DayKey, int]) -> None:
+        if not targets:
+            return
+        updated_at = datetime.now(timezone.utc).isoformat()
+        rows = [
+            {"chat_id": chat_id, "thread_id": thread_id, "user_id": user_id, "date": day, "count": count,
+             "updated_at": updated_at}
+            for (chat_id, thread_id, user_id, day), count in targets.items()
+        ]
+        await self._execute("increment_upsert", self._table().upsert(rows, on_conflict="chat_id,thread_id,user_id,date"))
+
+    # Постраничное чтение строк с фильтрами на стороне БД; в памяти не больше одной страницы.
+    # Конец – пустая страница: короткая страница может означать лишь, что max-rows сервера меньше page_size.
+    async def iter_range(self, start: Optional[date] = None, end: Optional[date] = None,
+                         chat_id: Optional[int] = None, thread_id: Optional[int] = None,
+                         user_ids: Optional[Iterable[int]] = None) -> AsyncIterator[dict]:
+        user_ids = list(user_ids) if user_ids is not None else None
+        offset = 0
+        while True:
+            query = self._table().select("chat_id, thread_id, user_id, date, count")
+            if start is not None:
+                query = query.gte("date", start.isoformat())
+            if end is not None:
+                query = query.lt("date", end.isoformat())
+            if chat_id is not None:
+                query = query.eq("chat_id", chat_id)
+            if thread_id is not None:
+                query = query.eq("thread_id", thread_id)
+            if user_ids:
+                query = query.in_("user_id", user_ids)
+            page = await self._execute(
+                "select_page",
+                query.order("date").order("chat_id").order("thread_id").order("user_id")
+                .range(offset, offset + self.page_size - 1)
+            )
+            if not page:
+                return
+            for row in page:
+                yield row
+            offset += len(page)
+
+    # Выгрузка строк с постраничным чтением по ключу, а не по смещению: записи во время выгрузки
+    # не сдвигают страницы. Без since строки идут по id, с since – только изменённые после since, по (updated_at, id).
+    async def iter_export(self, start: Optional[date] = None, end: Optional[date] = None,
+                          user_ids: Optional[Iterable[int]] = None, chat_id: Optional[int] = None,
+                          thread_id: Optional[int] = None, since: Optional[datetime] = None) -> AsyncIterator[dict]:
+        user_ids = list(user_ids) if user_ids is not None else None
+        last: Optional[dict] = None
+        while True:
+            query = self._table().select("id, chat_id, thread_id, user_id, date, count, updated_at")
+            if start is not None:
+                query = query.gte("date", start.isoformat())
+            if end is not None:
+                query = query.lt("date", end.isoformat())
+            if chat_id is not None:
+                query = query.eq("chat_id", chat_id)
+            if thread_id is not None:
+                query = query.eq("thread_id", thread_id)
+            if user_ids:
+                query = query.in_("user_id", user_ids)
+            if since is None:
+                if last is not None:
+                    query = query.gt("id", last["id"])
+                query = query.order("id")
+            else:
+                if last is None:
+                    query = query.gt("updated_at", since.isoformat())
+                else:
+                    mark = last["updated_at"]
+                    query = query.or_(f'updated_at.gt."{mark}",and(updated_at.eq."{mark}",id.gt.{last["id"]})')
+                query = query.order("updated_at").order("id")
+            page = await self._execute("export_page", query.limit(self.page_size))
+            if not page:
+                return
+            for row in page:
+                yield row
+            last = page[-1]
+
+    # Итоги по (chat_id, thread_id, user_id) за диапазон [start, end); без chat_id – по всем счётчикам
+    async def totals(self, start: Optional[date] = None, end: Optional[date] = None,
+                     chat_id: Optional[int] = None, thread_id: Optional[int] = None) -> Dict[UserKey, int]:
+        result: Dict[UserKey, int] = {}
+        async for row in self.iter_range(start, end, chat_id, thread_id):
+            key = (row["chat_id"], row["thread_id"], row["user_id"])
+            result[key] = result.get(key, 0) + row["count"]
+        return result
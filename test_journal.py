@@ -0,0 +1,103 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from journal import Journal
+from storage import ActionsStore
+
+CHAT_ID = -1001000000000
+MAX_ROWS = 3
+
+
+# Таблица actions в памяти с поведением PostgREST: ответ молча обрезается до MAX_ROWS строк
+class FakeQuery:
+    def __init__(self, table):
+        self._table = table
+        self._filters = []
+        self._range = None
+        self._upsert = None
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self._filters.append(lambda row: row[column] in values)
+        return self
+
+    def eq(self, column, value):
+        self._filters.append(lambda row: row[column] == value)
+        return self
+
+    def order(self, column):
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def upsert(self, rows, on_conflict):
+        self._upsert = rows
+        return self
+
+    async def execute(self):
+        if self._upsert is not None:
+            for row in self._upsert:
+                self._table[(row["chat_id"], row["thread_id"], row["user_id"], row["date"])] = row["count"]
+            return SimpleNamespace(data=self._upsert)
+        rows = [
+            {"chat_id": key[0], "thread_id": key[1], "user_id": key[2], "date": key[3], "count": count}
+            for key, count in sorted(self._table.items(), key=lambda item: (item[0][3], *item[0][:3]))
+        ]
+        rows = [row for row in rows if all(check(row) for check in self._filters)]
+        if self._range is not None:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        return SimpleNamespace(data=rows[:MAX_ROWS])
+
+
+class FakeClient:
+    def __init__(self):
+        self.actions = {}
+
+    def table(self, name):
+        return FakeQuery(self.actions)
+
+
+# Перенос журнала в actions, когда ключей больше, чем max-rows сервера и размер пачки
+class JournalReplayTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal = Journal(os.path.join(self.tmp.name, "journal.sqlite3"), batch_size=4)
+        await self.journal.open()
+        self.client = FakeClient()
+        self.store = ActionsStore("http://localhost", "key", page_size=10)
+        self.store._client = self.client
+
+    async def asyncTearDown(self):
+        await self.journal.stop()
+        self.tmp.cleanup()
+
+    async def test_replay_keeps_existing_counts_beyond_one_page(self):
+        existing = {(CHAT_ID, thread_id, 5, "2026-10-01"): 100 for thread_id in range(1, 7)}
+        self.client.actions.update(existing)
+        fresh = [(CHAT_ID, thread_id, 6, "2026-10-01") for thread_id in range(1, 4)]
+        for key in [*existing, *fresh]:
+            await self.journal.append(key, 1)
+        await self.journal.append(fresh[0], 1)
+
+        self.assertTrue(await self.journal.flush(self.store))
+
+        expected = {**{key: 101 for key in existing}, **{key: 1 for key in fresh}}
+        expected[fresh[0]] = 2
+        self.assertEqual(expected, self.client.actions)
+        self.assertEqual(0, self.journal.pending)
+
+    async def test_iter_range_reads_past_server_row_limit(self):
+        self.client.actions.update({(CHAT_ID, 1, user_id, "2026-10-01"): user_id for user_id in range(8)})
+        rows = [row async for row in self.store.iter_range(chat_id=CHAT_ID)]
+        self.assertEqual(list(range(8)), sorted(row["count"] for row in rows))
+
+
+if __name__ == "__main__":
+    unittest.main()
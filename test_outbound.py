@@ -0,0 +1,48 @@
+import asyncio
+import time
+import unittest
+
+from counter_editor import CounterEditor
+from outbound import EDIT, REPLY, OutboundScheduler
+
+CHAT_ID = -1001000000000
+
+
+# Ответы в чате, где счётчик правится непрерывно, не должны вытесняться правками до отказа по таймауту
+class OutboundStarvationTest(unittest.IsolatedAsyncioTestCase):
+    async def test_reply_overtakes_counter_edits_in_busy_chat(self):
+        outbound = OutboundScheduler(global_rate=100, chat_rate=5, chat_burst=1, yield_after=0.3,
+                                     max_wait={REPLY: 3.0})
+        outbound.start()
+        sent = []
+
+        async def send(chat_id, msg_id, text):
+            await outbound.submit(EDIT, chat_id, lambda: asyncio.sleep(0, sent.append(text)))
+
+        editor = CounterEditor(send, window=0.1)
+        stop = asyncio.Event()
+
+        async def messages():
+            count = 0
+            while not stop.is_set():
+                count += 1
+                editor.request(CHAT_ID, 1, lambda count=count: str(count))
+                await asyncio.sleep(0.05)
+
+        traffic = asyncio.create_task(messages())
+        try:
+            await asyncio.sleep(0.5)
+            started = time.monotonic()
+            result = await outbound.submit(REPLY, CHAT_ID, lambda: asyncio.sleep(0, "reply"))
+            self.assertEqual("reply", result)
+            self.assertLess(time.monotonic() - started, 1.5)
+            self.assertTrue(sent)
+        finally:
+            stop.set()
+            await traffic
+            await editor.close()
+            await outbound.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
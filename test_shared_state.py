@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+from datetime import date
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault("SECRET_TOKEN", "test")
+
+import bot  # noqa: E402
+from counters import Counter, CounterRegistry  # noqa: E402
+from journal import Journal  # noqa: E402
+from workers import SharedStateSync  # noqa: E402
+
+CHAT_ID = -1001000000000
+THREAD_ID = 7
+USER_ID = 5
+
+
+# Новый счётчик в режиме воркеров: сообщение, посчитанное пока /start_actions отправляет ответ,
+# не должно подменять опубликованные итоги одной дельтой
+class StartActionsPublishTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal = Journal(os.path.join(self.tmp.name, "journal.sqlite3"))
+        self.journal.shared = True
+        await self.journal.open()
+
+    async def asyncTearDown(self):
+        await self.journal.stop()
+        self.tmp.cleanup()
+
+    async def test_increment_during_reply_keeps_loaded_total(self):
+        async def load_counter(counter):
+            counter.counts[USER_ID] = 5000
+
+        async def reply(update, text, **kwargs):
+            # Сообщение в теме приходит, пока ответ ждёт лимита Telegram
+            await bot.record_increment(bot.registry.get(CHAT_ID, THREAD_ID), USER_ID, 1)
+            return SimpleNamespace(message_id=10, chat_id=CHAT_ID)
+
+        update = SimpleNamespace(
+            message=SimpleNamespace(message_thread_id=THREAD_ID),
+            effective_chat=SimpleNamespace(id=CHAT_ID),
+            effective_user=SimpleNamespace(id=USER_ID, first_name="Тест"),
+        )
+        with mock.patch.multiple(
+            bot,
+            WORKERS=2,
+            is_owner=False,
+            DEFAULT_PARTICIPANTS={},
+            journal=self.journal,
+            registry=CounterRegistry(date.today()),
+            load_counter=load_counter,
+            reply=reply,
+        ):
+            await bot.start_actions(update, None)
+            self.assertEqual(bot.registry.get(CHAT_ID, THREAD_ID).counts[USER_ID], 5001)
+
+        _, payloads, totals = await self.journal.changes(0)
+        self.assertEqual([(CHAT_ID, THREAD_ID, USER_ID, 5001)], totals)
+        self.assertEqual(10, payloads[0]["msg_id"])
+
+    # Сообщение сразу после /start_actions в другом воркере: счётчик ещё не пришёл фоновой синхронизацией
+    async def test_message_in_counter_created_by_another_worker_is_counted(self):
+        other = Counter(CHAT_ID, THREAD_ID, {USER_ID: "Тест"}, msg_id=10, counts={USER_ID: 7})
+        await self.journal.publish([(other.to_dict(), dict(other.counts))])
+        update = SimpleNamespace(
+            message=SimpleNamespace(message_thread_id=THREAD_ID),
+            effective_chat=SimpleNamespace(id=CHAT_ID),
+            effective_user=SimpleNamespace(id=USER_ID),
+        )
+        with mock.patch.multiple(
+            bot,
+            is_owner=False,
+            journal=self.journal,
+            registry=CounterRegistry(date.today()),
+            shared_sync=SharedStateSync(self.journal, bot.apply_shared_changes),
+        ):
+            await bot.count_messages(update, None)
+            counter = bot.registry.get(CHAT_ID, THREAD_ID)
+            self.assertIsNotNone(counter)
+            self.assertEqual(8, counter.counts[USER_ID])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ProcessFn = Callable[[dict], Awaitable[None]]
+
+
+# Ключ упорядочивания: обновления одного чата/темы обрабатываются строго по очереди
+def ordering_key(raw: dict) -> Hashable:
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        message = raw.get(field)
+        if message:
+            return message.get("chat", {}).get("id"), message.get("message_thread_id")
+    callback = raw.get("callback_query")
+    if callback and callback.get("message"):
+        message = callback["message"]
+        return message.get("chat", {}).get("id"), message.get("message_thread_id")
+    return raw.get("update_id")
+
+
+# Очередь входящих обновлений: вебхук только кладёт сырое обновление и сразу отвечает Telegram,
+# а обработку выполняют фоновые воркеры. Обновления распределяются по воркерам по ключу чата/темы,
+# поэтому порядок внутри одного чата сохраняется, а разные чаты обрабатываются параллельно.
+class UpdateQueue:
+    def __init__(self, process_fn: ProcessFn, workers: int = 4, max_size: int = 1000, dedup_size: int = 10000):
+        self._process = process_fn
+        self.workers = max(1, workers)
+        self.max_size = max_size
+        per_worker = max(1, -(-max_size // self.workers))
+        self._queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._tasks: List[asyncio.Task] = []
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._dedup_size = dedup_size
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.duplicates = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "capacity": self.max_size,
+            "workers": self.workers,
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+        }
+
+    # Возвращает False, если очередь переполнена: обновление не принято, Telegram доставит его повторно
+    def put_nowait(self, raw: dict) -> bool:
+        update_id: Optional[int] = raw.get("update_id")
+        if update_id is not None and update_id in self._seen:
+            self.duplicates += 1
+            logger.debug("Повторная доставка обновления %s пропущена", update_id)
+            return True
+        queue = self._queues[hash(ordering_key(raw)) % self.workers]
+        try:
+            queue.put_nowait(raw)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Очередь обновлений переполнена (глубина %s), обновление %s отклонено", self.depth, update_id)
+            return False
+        # Отмечаем только принятые обновления, чтобы повторная доставка отклонённого прошла
+        if update_id is not None:
+            self._seen[update_id] = None
+            if len(self._seen) > self._dedup_size:
+                self._seen.popitem(last=False)
+        return True
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+            logger.info(f"Очередь обновлений запущена: {self.workers} воркер(ов), ёмкость {self.max_size}")
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            raw = await queue.get()
+            self.in_flight += 1
+            try:
+                await self._process(raw)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка обработки обновления {raw.get('update_id')}: {str(e)}", exc_info=True)
+            finally:
+                self.in_flight -= 1
+                queue.task_done()
+
+    # Дожидается обработки уже принятых обновлений (не дольше timeout) и останавливает воркеров
+    async def stop(self, timeout: float = 10.0) -> None:
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались обработки {self.depth} обновлений при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,111 @@
+import asyncio
+import fcntl
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from multiprocessing.connection import wait
+from typing import Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ApplyFn = Callable[[list, list], Awaitable[None]]
+
+# Режим нескольких воркеров: родительский процесс открывает слушающий сокет и запускает WORKERS процессов,
+# каждый из которых принимает соединения с этого сокета и обрабатывает обновления целиком.
+# Один воркер – владелец (выбирается файловой блокировкой): он переносит журнал в Supabase, правит
+# сообщения-счётчики, сохраняет снимок и ставит вебхук. Общее состояние счётчиков лежит в файле журнала.
+
+
+# Возвращает дескриптор удерживаемой блокировки или None, если владелец уже есть.
+# Блокировка снимается ядром при завершении процесса.
+def try_acquire_owner(path: str) -> Optional[int]:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.setblocking(False)
+    sock.set_inheritable(True)
+    return sock
+
+
+# Запускает воркеров target(index, fd сокета, generation) и ждёт их. Если любой воркер завершился,
+# останавливаются все: перезапуск целиком выполняет платформа. Возвращает код выхода.
+def run_workers(count: int, port: int, target: Callable[[int, int, int], None]) -> int:
+    sock = bind_socket("0.0.0.0", port)
+    # Номер запуска: воркеры не примут общее состояние, оставшееся в файле с прошлого раза
+    generation = time.time_ns()
+    context = multiprocessing.get_context("fork")
+    processes: List[multiprocessing.Process] = [
+        context.Process(target=target, args=(index, sock.fileno(), generation), name=f"worker-{index}")
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Запущено воркеров: {count}, порт {port}")
+
+    def forward(signum, _frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    wait([process.sentinel for process in processes])
+    exited = [process for process in processes if not process.is_alive()]
+    for process in exited:
+        logger.info(f"Воркер {process.name} завершился с кодом {process.exitcode}")
+    forward(signal.SIGTERM, None)
+    for process in processes:
+        process.join()
+    sock.close()
+    return next((process.exitcode for process in exited if process.exitcode), 0)
+
+
+# Периодически забирает изменения общего состояния, сделанные любым воркером, и применяет их через apply_fn
+class SharedStateSync:
+    def __init__(self, journal, apply_fn: ApplyFn, interval: float = 0.5):
+        self._journal = journal
+        self._apply = apply_fn
+        self.interval = interval
+        self.seq = 0
+        self._task: Optional[asyncio.Task] = None
+        # Опрос вызывается и вне фоновой задачи; параллельные опросы применили бы одни изменения дважды
+        self._lock = asyncio.Lock()
+
+    async def poll(self) -> None:
+        async with self._lock:
+            seq, payloads, totals = await self._journal.changes(self.seq)
+            if payloads or totals:
+                await self._apply(payloads, totals)
+            self.seq = seq
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Ошибка синхронизации состояния воркеров: {str(e)}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None